@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# Benchmarks for bf_uploader.py (no network, no API key needed).
+#   hash:   SHA-256 throughput and peak RSS per sha256_file method
+#   upload: whole uploader runs against a local mock of BookFusion + S3 on synthetic libraries
+#   serve:  just the mock, for poking at it by hand
+
+import argparse, sys, os, json, subprocess, tempfile, threading, time, random, shlex, shutil, uuid, base64, socket
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+def _run_child(code, *argv):
+    out = subprocess.run([sys.executable, "-c", code, *argv], cwd=HERE, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+HASH_CHILD = """
+import sys, time, json, resource, bf_uploader as b
+path, method, chunk = sys.argv[1], sys.argv[2], int(sys.argv[3])
+t = time.perf_counter()
+digest = b.sha256_file(path, chunk, method)
+dt = time.perf_counter() - t
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"digest": digest, "secs": dt, "maxrss": peak if sys.platform == "darwin" else peak * 1024}))
+"""
+
+class MockBookFusion(ThreadingHTTPServer):
+    """
+    Local stand-in for /uploads/init, the presigned S3 POST (204) and /uploads/finalize.
+    `latency` adds a delay per API call and `s3_latency` per S3 POST (seconds),
+    `bandwidth` caps the combined S3 upload rate (bytes/s, shared by all connections),
+    `error_rate` answers that fraction of requests with 503 + Retry-After: 0,
+    `api_capacity` answers API calls beyond that many in flight with 429.
+    Per-endpoint latencies (request headers in -> response out, as seen by the
+    server) are collected in `timings`; reset() clears them between runs.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, s3_latency=0.0, bandwidth=None, error_rate=0.0, api_capacity=None):
+        super().__init__(("127.0.0.1", port), _MockHandler)
+        self.latency, self.s3_latency, self.bandwidth, self.error_rate = latency, s3_latency, bandwidth, error_rate
+        self.api_capacity, self.api_inflight = api_capacity, 0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0     # bandwidth pacing: when the shared uplink is free again
+        self.reset()
+
+    @property
+    def api_base(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/calibre-api/v1"
+
+    def reset(self):
+        with self.lock:
+            self.timings = {"init": [], "s3": [], "finalize": []}
+            self.errors = self.throttled = 0
+            self.s3_bytes = 0
+
+    def record(self, phase, secs, nbytes=0):
+        with self.lock:
+            self.timings[phase].append(secs)
+            self.s3_bytes += nbytes
+
+    def pace(self, n):
+        # Reserve n bytes on the shared uplink and sleep until they would have arrived
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_slot)
+            self.next_slot = start + n / self.bandwidth
+        time.sleep(max(self.next_slot - now, 0))
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle + delayed ACK adds ~40 ms per reply
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *a): pass
+
+    def _reply(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for k, v in headers: self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _drain(self, n):
+        srv, left = self.server, n
+        while left > 0:
+            piece = self.rfile.read(min(left, 64 * 1024))
+            if not piece: break
+            left -= len(piece)
+            if srv.bandwidth: srv.pace(len(piece))
+        return n - left
+
+    def do_POST(self):
+        srv, t = self.server, time.perf_counter()
+        phase = ("s3" if self.path == "/s3" else "init" if self.path.endswith("/uploads/init")
+                 else "finalize" if self.path.endswith("/uploads/finalize") else None)
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked" or "Content-Length" not in self.headers:
+            self.close_connection = True
+            return self._reply(411, b"Content-Length required")
+        nbytes = self._drain(int(self.headers["Content-Length"])) if phase == "s3" else len(self.rfile.read(int(self.headers["Content-Length"])))
+        if phase is None: return self._reply(404)
+        if random.random() < srv.error_rate:
+            with srv.lock: srv.errors += 1
+            return self._reply(503, b"injected", [("Retry-After", "0")])
+        if phase != "s3" and srv.api_capacity:
+            with srv.lock:
+                busy = srv.api_inflight >= srv.api_capacity
+                srv.throttled += busy
+                srv.api_inflight += not busy
+            if busy: return self._reply(429, b"slow down", [("Retry-After", "0")])
+            try:
+                time.sleep(srv.latency)
+            finally:
+                with srv.lock: srv.api_inflight -= 1
+        else:
+            time.sleep(srv.s3_latency if phase == "s3" else srv.latency)
+        if phase == "init":
+            exp = (datetime.now(timezone.utc) + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            policy = base64.b64encode(json.dumps({"expiration": exp}).encode()).decode()
+            out = {"url": f"http://127.0.0.1:{srv.server_address[1]}/s3",
+                   "params": {"key": "bench/" + uuid.uuid4().hex, "policy": policy}}
+            self._reply(200, json.dumps(out).encode(), [("Content-Type", "application/json")])
+        elif phase == "s3":
+            self._reply(204)
+        else:
+            self._reply(201, json.dumps({"id": uuid.uuid4().hex[:12]}).encode(), [("Content-Type", "application/json")])
+        srv.record(phase, time.perf_counter() - t, nbytes if phase == "s3" else 0)
+
+# Synthetic library shapes: (share, extension, median bytes, min, max); sizes are log-normal
+SHAPES = {
+    "tiny":   [(1.0, ".epub", 100e3, 20e3, 400e3)],
+    "ebooks": [(0.7, ".epub", 1.5e6, 50e3, 20e6), (0.2, ".mobi", 2e6, 100e3, 20e6), (0.1, ".azw3", 3e6, 100e3, 30e6)],
+    "pdfs":   [(1.0, ".pdf", 15e6, 1e6, 200e6)],
+    "mixed":  [(0.6, ".epub", 1.5e6, 50e3, 20e6), (0.1, ".mobi", 2e6, 100e3, 20e6), (0.3, ".pdf", 15e6, 1e6, 200e6)],
+}
+
+def make_library(root, shape, books, seed=0):
+    """Write `books` files of the given shape under root (100 per subdirectory). Returns total bytes."""
+    rng = random.Random(seed)
+    block = rng.randbytes(1024 * 1024)
+    total = 0
+    for i in range(books):
+        r, acc = rng.random(), 0.0
+        for share, ext, median, lo, hi in SHAPES[shape]:
+            acc += share
+            if r < acc: break
+        size = int(min(max(rng.lognormvariate(0, 0.8) * median, lo), hi))
+        d = Path(root) / f"d{i // 100:03d}"
+        d.mkdir(parents=True, exist_ok=True)
+        with open(d / f"book{i:05d}{ext}", "wb") as f:
+            f.write(f"{seed}:{i}:".encode())        # distinct digest per book
+            left = size
+            while left > 0:
+                left -= f.write(block[:min(left, len(block))])
+        total += size
+    return total
+
+def pct(values, q):
+    if not values: return None
+    v = sorted(values)
+    return v[min(len(v) - 1, max(0, round(q / 100 * len(v) + 0.5) - 1))]
+
+def run_uploader(srv, lib, extra):
+    """One bf_uploader.py batch run in a child process; returns (summary, wall secs, child peak RSS bytes)."""
+    with tempfile.TemporaryDirectory(prefix="bf_bench_state_") as state:
+        cmd = [sys.executable, str(HERE / "bf_uploader.py"), str(lib), "--api-base", srv.api_base, "--api-key", "bench",
+               "--state-db", os.path.join(state, "state.sqlite"), *extra]
+        with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+            t = time.perf_counter()
+            p = subprocess.Popen(cmd, stdout=out, stderr=err)
+            _, status, ru = os.wait4(p.pid, 0)
+            wall = time.perf_counter() - t
+            p.returncode = os.waitstatus_to_exitcode(status)
+            out.seek(0)
+            lines = out.read().decode().splitlines()
+            err.seek(0)
+            errors = err.read().decode(errors="replace").strip()
+    summary = next((json.loads(l)["summary"] for l in reversed(lines) if l.startswith('{"summary"')), None)
+    if summary is None:
+        raise RuntimeError(f"uploader exited {p.returncode} without a summary: {shlex.join(cmd)}\n{errors[-2000:]}")
+    rss = ru.ru_maxrss if sys.platform == "darwin" else ru.ru_maxrss * 1024
+    return summary, wall, rss
+
+def bench_upload(args):
+    srv = MockBookFusion(latency=args.latency_ms / 1000, s3_latency=args.s3_latency_ms / 1000,
+                         bandwidth=args.bandwidth * 1e6 if args.bandwidth else None, error_rate=args.error_rate,
+                         api_capacity=args.api_capacity)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    lib = Path(args.lib_dir) if args.lib_dir else Path(tempfile.mkdtemp(prefix="bf_bench_lib_"))
+    try:
+        if not any(lib.rglob("*.*")):
+            make_library(lib, args.shape, args.books, args.seed)
+        size = sum(p.stat().st_size for p in lib.rglob("*") if p.is_file())
+        nbooks = sum(1 for p in lib.rglob("*") if p.is_file())
+        print(f"# {nbooks} books, {size / 1e6:.1f} MB in {lib}; api {args.latency_ms} ms, s3 {args.s3_latency_ms} ms, "
+              f"bandwidth {args.bandwidth or 'unlimited'} MB/s, errors {args.error_rate:.0%}", file=sys.stderr)
+        for run in args.run or ["-j4"]:
+            for _ in range(args.repeat):
+                srv.reset()
+                summary, wall, rss = run_uploader(srv, lib, shlex.split(run) + ["--no-ledger", "--no-digest-cache"])
+                row = {"run": run, "books": summary["total"], "failed": summary["failed"],
+                       "books_s": round(summary["total"] / wall, 1), "MB_s": round(size / 1e6 / wall, 1),
+                       # book bytes read from disk per byte of library: ~2 two-pass, ~1 with --single-pass
+                       "bytes_read": summary["bytes_read"], "read_ratio": round(summary["bytes_read"] / max(size, 1), 2),
+                       "wall_s": round(wall, 3), "peak_rss_MB": round(rss / 1e6, 1), "injected_errors": srv.errors,
+                       "throttled": srv.throttled}
+                for phase, ts in srv.timings.items():
+                    row[phase] = {"n": len(ts), "p50_ms": round(pct(ts, 50) * 1000, 1) if ts else None,
+                                  "p99_ms": round(pct(ts, 99) * 1000, 1) if ts else None}
+                print(json.dumps(row), flush=True)
+    finally:
+        srv.shutdown()
+        if not args.lib_dir: shutil.rmtree(lib, ignore_errors=True)
+    return 0
+
+def serve(args):
+    srv = MockBookFusion(args.port, args.latency_ms / 1000, args.s3_latency_ms / 1000,
+                         args.bandwidth * 1e6 if args.bandwidth else None, args.error_rate, args.api_capacity)
+    print(f"mock BookFusion at {srv.api_base} (use --api-base {srv.api_base} --api-key anything)", file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        for phase, ts in srv.timings.items():
+            if ts: print(json.dumps({"phase": phase, "n": len(ts), "p50_ms": round(pct(ts, 50) * 1000, 1),
+                                     "p99_ms": round(pct(ts, 99) * 1000, 1)}))
+    return 0
+
+def make_file(path, size_mb):
+    with open(path, "wb") as f:
+        block = os.urandom(1024 * 1024)
+        for _ in range(size_mb): f.write(block)
+
+def bench_hash(args):
+    import bf_uploader as b
+    tmp = None
+    if args.file:
+        path = args.file
+    else:
+        tmp = tempfile.NamedTemporaryFile(prefix="bf_bench_", suffix=".pdf", dir=args.dir, delete=False)
+        tmp.close()
+        path = tmp.name
+        make_file(path, args.size_mb)
+    size = os.path.getsize(path)
+    m = b.mount_for(path)
+    print(f"# {path}: {size / 2**20:.0f} MiB on {m.point} ({m.fstype}{', network' if m.network else ''}), "
+          f"chunk {args.chunk} B, best of {args.repeat}", file=sys.stderr)
+    rows = []
+    try:
+        # one fresh interpreter per run so peak RSS isn't shared between methods
+        for method in args.methods:
+            best = None
+            for _ in range(args.repeat):
+                r = _run_child(HASH_CHILD, path, method, str(args.chunk))
+                if best is None or r["secs"] < best["secs"]: best = r
+            rows.append({"method": method, "MB_s": round(size / 1e6 / best["secs"], 1),
+                         "secs": round(best["secs"], 3), "peak_rss_MB": round(best["maxrss"] / 1e6, 1),
+                         "digest": best["digest"][:16]})
+    finally:
+        if tmp: os.unlink(path)
+    if len({r["digest"] for r in rows}) > 1:
+        print("digest mismatch between methods!", file=sys.stderr)
+        return 1
+    for r in rows: print(json.dumps(r))
+    return 0
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmarks for bf_uploader.py")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    h = sub.add_parser("hash", help="Compare sha256_file methods (read / readinto / mmap) on one file")
+    h.add_argument("--file", help="File to hash (default: a random temp file of --size-mb)")
+    h.add_argument("--size-mb", type=int, default=1024, help="Size of the generated file (default: 1024)")
+    h.add_argument("--dir", help="Where to create the generated file (default: system temp dir); put it on the disk you care about")
+    h.add_argument("--chunk", type=int, default=1024 * 1024, help="Chunk size in bytes (default: 1 MiB)")
+    h.add_argument("--repeat", type=int, default=3, help="Runs per method, best one is reported (default: 3)")
+    h.add_argument("--methods", nargs="+", default=["read", "readinto", "mmap"], help="Methods to compare")
+    for name, helptext in (("upload", "Run the uploader against a local mock BookFusion + S3 on a synthetic library"),
+                           ("serve", "Only run the mock BookFusion + S3 server")):
+        u = sub.add_parser(name, help=helptext)
+        u.add_argument("--latency-ms", type=float, default=0, help="Added latency per init/finalize call (default: 0)")
+        u.add_argument("--s3-latency-ms", type=float, default=0, help="Added latency per S3 POST (default: 0)")
+        u.add_argument("--bandwidth", type=float, metavar="MB/s", help="Combined S3 upload bandwidth (default: unlimited)")
+        u.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with 503 (default: 0)")
+        u.add_argument("--api-capacity", type=int, metavar="N", help="Answer init/finalize calls beyond N in flight with 429 (default: no limit)")
+        if name == "serve":
+            u.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+            continue
+        u.add_argument("--shape", choices=sorted(SHAPES), default="ebooks", help="Synthetic library shape (default: ebooks)")
+        u.add_argument("--books", type=int, default=200, help="Books in the synthetic library (default: 200)")
+        u.add_argument("--seed", type=int, default=0, help="Seed for the library's file sizes (default: 0)")
+        u.add_argument("--lib-dir", help="Keep the library here and reuse it on later runs (default: a temp dir, deleted afterwards)")
+        u.add_argument("--run", action="append", metavar="ARGS",
+                       help="Repeatable. Uploader options for one configuration, e.g. --run='-j8 --async' (default: -j4)")
+        u.add_argument("--repeat", type=int, default=1, help="Runs per configuration (default: 1)")
+    args = ap.parse_args()
+    return {"hash": bench_hash, "upload": bench_upload, "serve": serve}[args.cmd](args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,22 +3,511 @@
 # Flow: /uploads/init -> S3 POST -> /uploads/finalize (Rails-style metadata)
 # Mirrors the Calibre plugin’s fields + digest computation.
 
-import argparse, sys, os, json, hashlib, mimetypes
+import argparse, sys, os, json, csv, hashlib, mimetypes, glob, time, threading, contextlib, tempfile, sqlite3, re, zipfile
+import base64, zlib, struct, itertools, shutil, random, asyncio, queue, multiprocessing, mmap, stat, subprocess, functools, socket, bisect, signal
+from collections import namedtuple, deque
+from datetime import datetime, date
+from email.utils import parsedate_to_datetime
+from urllib.parse import unquote
+import posixpath
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
+import xml.etree.ElementTree as ET
 import requests
+from requests.adapters import HTTPAdapter
+try:
+    import aiohttp          # optional: only AsyncBFClient / --async need it
+except ImportError:
+    aiohttp = None
 
 API_BASE_DEFAULT = "https://www.bookfusion.com/calibre-api/v1"
+BOOK_EXTS = (".epub", ".pdf", ".mobi", ".azw3")
+HASH_CHUNK = 1024 * 1024
+UPLOAD_CHUNK = 256 * 1024
+CHUNK_CANDIDATES = (64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+CHUNK_PROBE_BYTES = 16 * 1024 * 1024     # read per candidate when auto-tuning
+CHUNK_RETUNE_DAYS = 30
+SPOOL_MAX_MB = 64
+SPOOL_BUDGET_MB = 128
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 120.0                     # per socket read, not for the whole request
+HTTP_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+STATE_DB_DEFAULT = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "bf_uploader" / "state.sqlite"
 
-def sha256_file(path, chunk=1024*1024):
+HASH_METHODS = ("auto", "mmap", "readinto", "read")
+MMAP_WINDOW = 16 * 1024 * 1024
+NETWORK_FS = {"nfs", "nfs4", "cifs", "smb", "smb2", "smb3", "smbfs", "afpfs", "webdav", "davfs", "9p",
+              "afs", "ceph", "glusterfs", "lustre", "gpfs", "fuse.sshfs", "sshfs", "fuse.rclone"}
+
+Mount = namedtuple("Mount", "point fstype network")
+_mounts = {}
+
+def _mount_table():
+    # [(mount point, fstype, is_network)] from /proc/self/mounts (Linux) or `mount` (macOS/BSD)
+    try:
+        with open("/proc/self/mounts") as f:
+            rows = [l.split()[1:3] for l in f]
+        return [(p.replace("\\040", " "), t, t in NETWORK_FS) for p, t in rows]
+    except OSError:
+        pass
+    try:
+        out = subprocess.run(["mount"], capture_output=True, text=True, timeout=5).stdout
+    except (OSError, subprocess.SubprocessError):
+        return []
+    table = []
+    for line in out.splitlines():
+        # "/dev/disk3s1 on / (apfs, local, journaled)"
+        if " on " not in line or "(" not in line: continue
+        point, opts = line.split(" on ", 1)[1].rsplit(" (", 1)
+        opts = [o.strip() for o in opts.rstrip(")").split(",")]
+        table.append((point, opts[0], "local" not in opts))
+    return table
+
+def mount_for(path):
+    """Mount(point, fstype, network) of the filesystem holding path, cached per device."""
+    dev = os.stat(path).st_dev
+    m = _mounts.get(dev)
+    if m is None:
+        real = os.path.realpath(path)
+        best = ("/", "", False)
+        for point, fstype, network in _mount_table():
+            if (real == point or real.startswith(point.rstrip("/") + "/")) and len(point) >= len(best[0]):
+                best = (point, fstype, network)
+        m = _mounts[dev] = Mount(*best)
+    return m
+
+def sha256_file(path, chunk=HASH_CHUNK, method="auto"):
+    """
+    SHA-256 of a file. Methods:
+      mmap     - hash memoryview slices of the mapped file, no copies into Python bytes;
+                 mapped in MMAP_WINDOW windows so resident memory stays bounded
+      readinto - readinto() one reused buffer
+      read     - plain read() loop (one new bytes object per chunk)
+      auto     - mmap for regular files on local filesystems, readinto elsewhere
+                 (pipes/devices, and network mounts where page faults are slow)
+    """
     h = hashlib.sha256()
     with open(path, 'rb') as f:
-        while True:
-            b = f.read(chunk)
-            if not b: break
-            h.update(b)
+        st = os.fstat(f.fileno())
+        if method == "auto":
+            method = "mmap" if stat.S_ISREG(st.st_mode) and st.st_size and not mount_for(path).network else "readinto"
+        if method == "mmap" and st.st_size:
+            _hash_mmap(h, f.fileno(), st.st_size, chunk)
+        elif method in ("readinto", "mmap"):
+            buf = bytearray(chunk)
+            mv = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n: break
+                h.update(mv[:n])
+        else:
+            while True:
+                b = f.read(chunk)
+                if not b: break
+                h.update(b)
     return h.hexdigest()
 
-def compute_calibre_metadata_digest(meta: dict, cover_path: str|None):
+def _hash_mmap(h, fd, size, chunk):
+    window = max(MMAP_WINDOW // mmap.ALLOCATIONGRANULARITY, 1) * mmap.ALLOCATIONGRANULARITY
+    for off in range(0, size, window):
+        with mmap.mmap(fd, min(window, size - off), offset=off, access=mmap.ACCESS_READ) as m:
+            if hasattr(m, "madvise"): m.madvise(mmap.MADV_SEQUENTIAL)
+            mv = memoryview(m)
+            try:
+                for i in range(0, len(m), chunk):
+                    h.update(mv[i:i + chunk])
+            finally:
+                mv.release()
+
+class SpoolBudget:
+    """
+    Bytes all live spools may hold in RAM together (--spool-budget). take() never
+    blocks: a book that doesn't fit is spooled to a temp file instead, so hashing
+    can't stall behind (or deadlock with) the uploads that would free the budget.
+    """
+    def __init__(self, limit):
+        self.limit, self.used = limit, 0
+        self.lock = threading.Lock()
+
+    def take(self, n):
+        with self.lock:
+            if self.used + n > self.limit: return False
+            self.used += n
+            return True
+
+    def give(self, n):
+        with self.lock: self.used -= n
+
+class _Spool(tempfile.SpooledTemporaryFile):
+    # Hands its RAM reservation back to the SpoolBudget when closed
+    def __init__(self, max_size, budget=None, reserved=0):
+        super().__init__(max_size=max_size)
+        self._budget, self._reserved = budget, reserved
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self._budget is not None: self._budget.give(self._reserved)
+            self._budget = None
+
+def hash_and_spool(path, spool_max=SPOOL_MAX_MB*1024*1024, chunk=HASH_CHUNK, budget=None):
+    """
+    Single-pass read: hash the book while copying it into a SpooledTemporaryFile
+    (kept in RAM up to spool_max, rolled over to local temp disk beyond), so the
+    S3 upload is served from the spool instead of re-reading the source. With a
+    SpoolBudget, books that are over spool_max or don't fit in what's left of the
+    budget go straight to temp disk.
+    Returns (hexdigest, spool); the caller closes the spool.
+    """
+    h = hashlib.sha256()
+    reserved, in_ram = 0, True
+    if budget is not None:
+        size = os.path.getsize(path)
+        in_ram = size <= spool_max and budget.take(size)
+        reserved = size if in_ram else 0
+    spool = _Spool(spool_max, budget if in_ram else None, reserved)
+    if not in_ram: spool.rollover()
+    elif reserved:
+        # Size the in-RAM buffer once; growing it chunk by chunk reallocates (and
+        # briefly holds two copies of) the book, which the budget doesn't see
+        spool.seek(reserved - 1)
+        spool.write(b"\0")
+        spool.seek(0)
+    buf = bytearray(chunk)
+    mv = memoryview(buf)
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                n = f.readinto(buf)
+                if not n: break
+                h.update(mv[:n])
+                spool.write(mv[:n])
+        spool.truncate()    # in case the book shrank while being read
+    except BaseException:
+        spool.close()
+        raise
+    return h.hexdigest(), spool
+
+def probe_chunk_size(path, candidates=CHUNK_CANDIDATES, per_candidate=CHUNK_PROBE_BYTES):
+    """
+    Time cold sequential reads of `path` with each candidate chunk size, each over
+    its own stretch of the file (dropped from the page cache first where
+    posix_fadvise exists, so the device is measured rather than RAM).
+    Returns (chunk, MB/s) for the size within 5% of the fastest that is closest
+    to HASH_CHUNK, or None if the file is too small to tell (< 1 MiB per candidate).
+    """
+    span = min(per_candidate, os.path.getsize(path) // len(candidates))
+    if span < 1024 * 1024: return None
+    rates = {}
+    with open(path, "rb", buffering=0) as f:
+        buf = memoryview(bytearray(max(candidates)))
+        for i, chunk in enumerate(candidates):
+            off = i * span
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), off, span, os.POSIX_FADV_DONTNEED)
+            f.seek(off)
+            left, t = span, time.perf_counter()
+            while left > 0:
+                n = f.readinto(buf[:min(chunk, left)])
+                if not n: break
+                left -= n
+            rates[chunk] = (span - left) / 1e6 / max(time.perf_counter() - t, 1e-9)
+    best = max(rates.values())
+    chunk = min((c for c, r in rates.items() if r >= best * 0.95), key=lambda c: max(c, HASH_CHUNK) / min(c, HASH_CHUNK))
+    return chunk, round(rates[chunk], 1)
+
+class StateDB:
+    """
+    SQLite file holding the uploader's local state (digest cache, upload ledger).
+    One connection shared by all worker threads behind a lock; writes are
+    committed in batches unless the caller asks for an immediate commit.
+    """
+    COMMIT_EVERY = 200
+
+    def __init__(self, path):
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.RLock()
+        self.pending = 0
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def write(self, sql, params=(), commit=False, many=False):
+        with self.lock:
+            (self.conn.executemany if many else self.conn.execute)(sql, params)
+            self.pending += 1
+            if commit or self.pending >= self.COMMIT_EVERY:
+                self.commit()
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+def _stat_key(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+class DigestCache:
+    """
+    Persistent map (device, inode, size, mtime_ns) -> SHA-256, so unchanged books
+    are never re-hashed. The path is stored only so prune() can find stale rows.
+    """
+    def __init__(self, state: StateDB):
+        self.state = state
+        state.write("""CREATE TABLE IF NOT EXISTS digests (
+            dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,
+            path TEXT, sha256 TEXT NOT NULL, seen_at REAL,
+            PRIMARY KEY (dev, ino, size, mtime_ns))""", commit=True)
+
+    def get(self, st):
+        key = _stat_key(st)
+        rows = self.state.query("SELECT sha256 FROM digests WHERE dev=? AND ino=? AND size=? AND mtime_ns=?", key)
+        if not rows: return None
+        self.state.write("UPDATE digests SET seen_at=? WHERE dev=? AND ino=? AND size=? AND mtime_ns=?", (time.time(), *key))
+        return rows[0][0]
+
+    def put(self, path, st, sha256):
+        self.state.write("INSERT OR REPLACE INTO digests VALUES (?,?,?,?,?,?,?)",
+                         (*_stat_key(st), str(path), sha256, time.time()))
+
+    def prune(self, older_than_days=None):
+        """
+        Drop rows whose file is gone or has changed (its current stat no longer
+        matches the key), and with older_than_days also rows not used for that
+        long; then VACUUM. Returns (removed, kept).
+        """
+        cutoff = time.time() - older_than_days * 86400 if older_than_days else None
+        stale = []
+        rows = self.state.query("SELECT rowid, dev, ino, size, mtime_ns, path, seen_at FROM digests")
+        for rowid, dev, ino, size, mtime_ns, path, seen_at in rows:
+            try:
+                alive = _stat_key(os.stat(path)) == (dev, ino, size, mtime_ns)
+            except OSError:
+                alive = False
+            if not alive or (cutoff and (seen_at or 0) < cutoff):
+                stale.append((rowid,))
+        self.state.write("DELETE FROM digests WHERE rowid=?", stale, commit=True, many=True)
+        self.state.query("VACUUM")
+        return len(stale), len(rows) - len(stale)
+
+def account_key(api_base, api_key):
+    """(API base, SHA-256 prefix of the API key): the account and endpoint local upload state belongs to."""
+    return api_base.rstrip("/"), hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+class UploadLedger:
+    """
+    Local record of books already on BookFusion: file digest -> metadata digest,
+    S3 key and bookfusion_id, written after every successful finalize. Lets later
+    runs skip unchanged books without an /uploads/init round trip. Rows belong to
+    one `account` (see account_key), so the same book is still uploaded to other
+    accounts and endpoints sharing the state database.
+    """
+    Entry = namedtuple("Entry", "file_digest meta_digest s3_key bookfusion_id")
+
+    def __init__(self, state: StateDB, account=("", "")):
+        self.state = state
+        self.account = tuple(account)
+        cols = [r[1] for r in state.query("PRAGMA table_info(uploads)")]
+        if cols and "api_base" not in cols:
+            # Rows from before the ledger was per account can't be attributed to one;
+            # dropping them costs one /uploads/init per book on the next run
+            state.write("DROP TABLE uploads", commit=True)
+        state.write("""CREATE TABLE IF NOT EXISTS uploads (
+            api_base TEXT, key_hash TEXT, file_digest TEXT, meta_digest TEXT, s3_key TEXT,
+            bookfusion_id TEXT, path TEXT, uploaded_at REAL,
+            PRIMARY KEY (api_base, key_hash, file_digest))""", commit=True)
+
+    def get(self, file_digest):
+        rows = self.state.query("SELECT file_digest, meta_digest, s3_key, bookfusion_id FROM uploads "
+                                "WHERE api_base=? AND key_hash=? AND file_digest=?", (*self.account, file_digest))
+        return self.Entry(*rows[0]) if rows else None
+
+    def record(self, path, file_digest, meta_digest, s3_key, bookfusion_id):
+        # Committed right away: a lost record means a needless re-upload next run
+        self.state.write("INSERT OR REPLACE INTO uploads VALUES (?,?,?,?,?,?,?,?)",
+                         (*self.account, file_digest, meta_digest, s3_key, str(bookfusion_id), str(path), time.time()),
+                         commit=True)
+
+class ChunkSizes:
+    """
+    Read sizes for hashing and S3 uploads. `size` fixes both; None keeps the
+    defaults (HASH_CHUNK / UPLOAD_CHUNK); "auto" runs probe_chunk_size() on the
+    first big-enough file of each mount point and uses the winner for every
+    file on it. Choices are kept in the state database (if given) and
+    re-measured after CHUNK_RETUNE_DAYS.
+    """
+    def __init__(self, size=None, state: StateDB=None):
+        self.size = size
+        self.state = state
+        self.chosen = {}          # mount point -> chunk
+        self.lock = threading.Lock()
+        if state is not None and size == "auto":
+            state.write("""CREATE TABLE IF NOT EXISTS chunk_sizes (
+                mount TEXT PRIMARY KEY, fstype TEXT, chunk INTEGER, mb_s REAL, measured_at REAL)""", commit=True)
+
+    def hash(self, path):
+        return self.size if isinstance(self.size, int) else self._tuned(path) or HASH_CHUNK
+
+    def upload(self, path):
+        return self.size if isinstance(self.size, int) else self._tuned(path) or UPLOAD_CHUNK
+
+    def _tuned(self, path):
+        if self.size != "auto": return None
+        try:
+            m = mount_for(path)
+        except OSError:
+            return None
+        with self.lock:
+            chunk = self.chosen.get(m.point)
+            if chunk: return chunk
+            if self.state is not None:
+                rows = self.state.query("SELECT chunk FROM chunk_sizes WHERE mount=? AND measured_at>?",
+                                        (m.point, time.time() - CHUNK_RETUNE_DAYS * 86400))
+                if rows:
+                    chunk = self.chosen[m.point] = rows[0][0]
+                    return chunk
+            try:
+                probe = probe_chunk_size(path)
+            except OSError:
+                probe = None
+            if probe is None: return None    # too small; try again on the next file
+            chunk = self.chosen[m.point] = probe[0]
+            if self.state is not None:
+                self.state.write("INSERT OR REPLACE INTO chunk_sizes VALUES (?,?,?,?,?)",
+                                 (m.point, m.fstype, probe[0], probe[1], time.time()), commit=True)
+            return chunk
+
+DEFAULT_CHUNKS = ChunkSizes()
+
+class Journal:
+    """
+    Append-only JSON-lines log of how far each file got in a batch
+    (hashed -> inited -> uploaded -> finalized), so an interrupted run resumes
+    every book at its last completed phase. A record only applies while the
+    file's size and mtime are unchanged. Appends are fsync'd in batches (every
+    FSYNC_EVERY records or FSYNC_INTERVAL seconds, and on close); a crash loses
+    at most that window, which just means redoing those phases. On open the
+    last record per path wins, and an overgrown file is compacted. Records carry
+    the `account` (see account_key) they were made for and only apply to it.
+    """
+    FSYNC_EVERY = 64
+    FSYNC_INTERVAL = 1.0
+
+    def __init__(self, path, account=None):
+        self.path = Path(path).expanduser()
+        self.account = "#".join(account) if account else None
+        self.entries = {}
+        lines = 0
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue    # torn last line from a crash
+                    self.entries[rec["path"]] = rec
+        if lines > 2 * len(self.entries) + 1000:
+            self._compact()
+        self.f = open(self.path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def _compact(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for rec in self.entries.values():
+                f.write(json.dumps(rec) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def get(self, path, st):
+        """Latest record for path, or None if there is none, it's another account's or the file changed since."""
+        rec = self.entries.get(str(path))
+        if rec and rec.get("account") == self.account and rec["size"] == st.st_size and rec["mtime_ns"] == st.st_mtime_ns:
+            return rec
+        return None
+
+    def log(self, path, st, phase, **fields):
+        rec = {"path": str(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns, "phase": phase, **fields}
+        if self.account: rec["account"] = self.account
+        line = json.dumps(rec) + "\n"
+        with self.lock:
+            self.entries[rec["path"]] = rec
+            self.f.write(line)
+            self.unsynced += 1
+            if self.unsynced >= self.FSYNC_EVERY or time.monotonic() - self.synced_at >= self.FSYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            self.f.close()
+
+Prepared = namedtuple("Prepared", "digest spool bytes_read hash_secs", defaults=(0.0,))
+
+def prepare_book(path, cache=None, rehash=False, single_pass=False, spool_max=SPOOL_MAX_MB*1024*1024, journal=None,
+                 hasher=sha256_file, chunks=DEFAULT_CHUNKS, spool_budget=None):
+    """
+    Hashing step ahead of /uploads/init: take the digest from the journal or cache
+    if the file is unchanged, else hash it (into a spool with single_pass, otherwise
+    with `hasher(path, chunk)`), cache it and journal it as "hashed". `chunks` picks
+    the read size; `spool_budget` (a SpoolBudget) caps RAM held by live spools.
+    Returns Prepared(digest, spool or None, bytes read from the book, seconds spent).
+    """
+    t = time.perf_counter()
+    st = os.stat(path)
+    rec = journal.get(path, st) if journal is not None else None
+    if rec and not rehash: return Prepared(rec["digest"], None, 0, time.perf_counter() - t)
+    if cache is not None and not rehash:
+        digest = cache.get(st)
+        if digest: return Prepared(digest, None, 0, time.perf_counter() - t)
+    if single_pass:
+        digest, spool = hash_and_spool(path, spool_max, chunks.hash(path), spool_budget)
+    else:
+        digest, spool = hasher(path, chunks.hash(path)), None
+    # Only cache if the file didn't change while we were reading it
+    if _stat_key(os.stat(path)) == _stat_key(st):
+        if cache is not None: cache.put(path, st, digest)
+        if journal is not None: journal.log(path, st, "hashed", digest=digest)
+    return Prepared(digest, spool, st.st_size, time.perf_counter() - t)
+
+Cover = namedtuple("Cover", "name data mimetype")
+COVER_MAX = 4 * 1024 * 1024          # embedded covers larger than this are left out
+
+def load_cover(cover):
+    """
+    Read a cover image once into a Cover(name, data, mimetype) that both the
+    metadata digest and /uploads/finalize use. Accepts a path, an existing Cover
+    or None; a path that isn't a file yields None (the cover is then left out).
+    """
+    if cover is None or isinstance(cover, Cover): return cover
+    p = Path(cover)
+    if not p.is_file(): return None
+    return Cover(p.name, p.read_bytes(), guess_mimetype(p))
+
+_ZEROS = memoryview(bytes(64 * 1024))
+
+def compute_calibre_metadata_digest(meta: dict, cover_path: str|Cover|None):
     """
     Matches the plugin's get_metadata_digest:
     concat these UTF-8 bytes in order (only if present):
@@ -27,6 +516,7 @@ def compute_calibre_metadata_digest(meta: dict, cover_path: str|None):
       each author, each tag,
       each bookshelf (IF bookshelves is not None),
       cover: bytes(size) of 0x00, then a single 0x00 byte, then cover bytes.
+    The zero run is fed from a small shared buffer, so memory doesn't grow with the cover.
     """
     h = hashlib.sha256()
 
@@ -60,17 +550,15 @@ def compute_calibre_metadata_digest(meta: dict, cover_path: str|None):
             upd(sh)
 
     # Cover
-    if cover_path:
-        p = Path(cover_path)
-        if p.is_file():
-            size = p.stat().st_size
-            h.update(bytes(size))      # N zero bytes
-            h.update(b"\x00")
-            with open(p, "rb") as f:
-                while True:
-                    b = f.read(65536)
-                    if not b: break
-                    h.update(b)
+    cover = load_cover(cover_path) if cover_path else None
+    if cover:
+        left = len(cover.data)         # N zero bytes
+        while left:
+            n = min(left, len(_ZEROS))
+            h.update(_ZEROS[:n])
+            left -= n
+        h.update(b"\x00")
+        h.update(cover.data)
 
     return h.hexdigest()
 
@@ -78,14 +566,357 @@ def guess_mimetype(path: Path):
     mt, _ = mimetypes.guess_type(str(path))
     return mt or "application/octet-stream"
 
+def _quote_param(v: str):
+    # Same escaping browsers (and urllib3) apply to form-data names/filenames
+    return v.replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+def _part_header(boundary, name, filename=None, content_type=None):
+    h = f'--{boundary}\r\nContent-Disposition: form-data; name="{_quote_param(name)}"'
+    if filename is not None: h += f'; filename="{_quote_param(filename)}"'
+    if content_type: h += f"\r\nContent-Type: {content_type}"
+    return (h + "\r\n\r\n").encode("utf-8")
+
+def encode_multipart(parts):
+    """
+    In-memory multipart/form-data for small forms, laid out exactly like requests'
+    files=: parts are (name, (filename or None, str|bytes[, content_type])).
+    Returns (body, content_type).
+    """
+    boundary = os.urandom(16).hex()
+    out = []
+    for name, (filename, value, *ctype) in parts:
+        out.append(_part_header(boundary, name, filename, ctype[0] if ctype else None))
+        out.append((value if isinstance(value, (bytes, bytearray)) else str(value).encode("utf-8")) + b"\r\n")
+    out.append(f"--{boundary}--\r\n".encode("ascii"))
+    return b"".join(out), f"multipart/form-data; boundary={boundary}"
+
+class MultipartFileBody:
+    """
+    Streaming multipart/form-data body: text fields first, then a single file part
+    read from disk in fixed-size chunks. len() is known up front, so requests sends
+    a Content-Length (S3 POST rejects chunked transfer encoding) and memory use
+    stays at one chunk regardless of file size. Each iteration re-reads the file,
+    so the same body can be sent again. With `source` (a seekable binary file
+    holding the same bytes, e.g. a single-pass spool) the file part is read from
+    there instead of from `path`. With `limiter` (a TokenBucket) every chunk
+    waits for its bytes before it is handed to the connection.
+    """
+    def __init__(self, fields: dict, file_field: str, path: Path, filename=None, content_type=None,
+                 chunk=UPLOAD_CHUNK, source=None, limiter=None):
+        self.path = Path(path)
+        self.source = source
+        self.chunk = chunk
+        self.limiter = limiter
+        self.boundary = os.urandom(16).hex()
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        head = []
+        for k, v in fields.items():
+            head.append(_part_header(self.boundary, k))
+            head.append(str(v).encode("utf-8") + b"\r\n")
+        head.append(_part_header(self.boundary, file_field, filename or self.path.name,
+                                 content_type or guess_mimetype(self.path)))
+        self._head = b"".join(head)
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("ascii")
+        if source is not None:
+            source.seek(0, os.SEEK_END)
+            self.file_size = source.tell()
+        else:
+            self.file_size = self.path.stat().st_size
+
+    def __len__(self):
+        return len(self._head) + self.file_size + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        if self.source is not None:
+            self.source.seek(0)
+            src = contextlib.nullcontext(self.source)
+        else:
+            src = open(self.path, "rb")
+        with src as f:
+            while True:
+                b = f.read(self.chunk)
+                if not b: break
+                if self.limiter: self.limiter.take(len(b))
+                yield b
+        yield self._tail
+
+    async def aiter_chunks(self):
+        """Same chunks as iter(), for asyncio clients: file I/O runs in the default thread pool."""
+        yield self._head
+        if self.source is not None:
+            f = self.source
+            await asyncio.to_thread(f.seek, 0)
+        else:
+            f = await asyncio.to_thread(open, self.path, "rb")
+        try:
+            while True:
+                b = await asyncio.to_thread(f.read, self.chunk)
+                if not b: break
+                if self.limiter: await self.limiter.atake(len(b))
+                yield b
+        finally:
+            if self.source is None: f.close()
+        yield self._tail
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, up to `burst` (default: one
+    second's worth) saved up while idle. take(n) reserves n tokens and sleeps until
+    they are covered; a reservation larger than what is available puts the bucket
+    in debt, so later callers queue behind it in order. rate None/0 = unlimited.
+    set_rate() applies to reservations made after it.
+    """
+    def __init__(self, rate=None, burst=None):
+        self.lock = threading.Lock()
+        self.tokens, self.stamp = 0.0, time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.rate = rate or None
+            self.burst = burst or max(rate or 0, 1)
+            self.tokens = min(self.tokens, self.burst)
+
+    def _reserve(self, n):
+        with self.lock:
+            if not self.rate: return 0.0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate) - n
+            self.stamp = now
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def take(self, n=1):
+        wait = self._reserve(n)
+        if wait: time.sleep(wait)
+
+    async def atake(self, n=1):
+        wait = self._reserve(n)
+        if wait: await asyncio.sleep(wait)
+
+class RateLimits:
+    """
+    Global rate limits shared by every worker: S3 upload bytes/s and BookFusion API
+    requests/s (init and finalize, retries included). Changeable while running.
+    """
+    def __init__(self, s3_bytes=None, api_rps=None):
+        self.s3 = TokenBucket(s3_bytes)
+        self.api = TokenBucket(api_rps)
+
+    def set(self, s3_bytes=None, api_rps=None):
+        self.s3.set_rate(s3_bytes)
+        self.api.set_rate(api_rps)
+
+    def __str__(self):
+        s3 = f"{self.s3.rate / 1e6:g} MB/s" if self.s3.rate else "unlimited"
+        api = f"{self.api.rate:g} req/s" if self.api.rate else "unlimited"
+        return f"S3 {s3}, API {api}"
+
+NO_RATES = RateLimits()
+
+def read_rate_file(path):
+    """
+    Rate control file: `key = value` lines, '#' comments. Keys: s3_bandwidth (MB/s)
+    and api_rate (requests/s); 0, "off" or a missing key means unlimited.
+    Returns RateLimits.set() keywords.
+    """
+    vals = {}
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line: continue
+            k, sep, v = line.partition("=")
+            k, v = k.strip(), v.strip().lower()
+            if not sep or k not in ("s3_bandwidth", "api_rate"):
+                raise ValueError(f"{path}: unknown setting {line!r}")
+            vals[k] = 0.0 if v in ("off", "none", "") else float(v)
+    return {"s3_bytes": vals.get("s3_bandwidth", 0) * 1e6, "api_rps": vals.get("api_rate", 0)}
+
+class RateControl:
+    """
+    Keeps `rates` in sync with a rate control file: re-read when its mtime changes
+    (polled every `interval` seconds) and right away on SIGHUP. Runs as a daemon
+    thread; a file that can't be read or parsed leaves the current limits alone.
+    """
+    def __init__(self, rates: RateLimits, path, interval=1.0, verbose=True):
+        self.rates, self.path, self.interval, self.verbose = rates, path, interval, verbose
+        self.mtime = None
+        self.wake = threading.Event()
+        self.stopped = False
+        self.reload()
+        if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, lambda *_: self.wake.set())
+        threading.Thread(target=self._run, name="rate-control", daemon=True).start()
+
+    def reload(self, force=False):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self.mtime and not force: return
+            self.mtime = mtime
+            self.rates.set(**read_rate_file(self.path))
+        except (OSError, ValueError) as e:
+            print(f"rate control: {e}", file=sys.stderr)
+            return
+        if self.verbose: print(f"rate limits: {self.rates}", file=sys.stderr)
+
+    def _run(self):
+        while not self.stopped:
+            hup = self.wake.wait(self.interval)
+            self.wake.clear()
+            if not self.stopped: self.reload(force=hup)
+
+    def close(self):
+        self.stopped = True
+        self.wake.set()
+
+class BFClient:
+    """
+    Keep-alive connection pools shared by every phase and every book:
+    one session for the BookFusion API host, one for the S3 bucket host.
+    `rates` throttles S3 upload bytes across all of them; its API bucket is for
+    the callers, who take a token before their concurrency slot (so a rate wait
+    isn't counted as request latency). `timeout` is the requests (connect, read)
+    pair used for every call.
+    """
+    def __init__(self, api_base, auth, pool_size=10, rates=NO_RATES, timeout=HTTP_TIMEOUT):
+        self.api_base = api_base
+        self.auth = auth
+        self.rates = rates
+        self.timeout = timeout
+        self.api = self._session(pool_size)
+        self.s3  = self._session(pool_size)
+
+    @staticmethod
+    def _session(pool_size):
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        return s
+
+    def init(self, filename, file_digest, verbose=False):
+        return do_init(self.api_base, self.auth, filename, file_digest, verbose, session=self.api,
+                       timeout=self.timeout)
+
+    def s3_post(self, s3_url, s3_params, book_path, verbose=False, source=None, chunk=UPLOAD_CHUNK):
+        return do_s3_post(s3_url, s3_params, book_path, verbose, session=self.s3, source=source, chunk=chunk,
+                          limiter=self.rates.s3, timeout=self.timeout)
+
+    def finalize(self, s3_key, file_digest, meta, meta_digest, cover_path=None, verbose=False):
+        return do_finalize(self.api_base, self.auth, s3_key, file_digest, meta, meta_digest, cover_path, verbose,
+                           session=self.api, timeout=self.timeout)
+
+    def stats(self):
+        """Per-session connection counters: requests sent, connections opened, requests that reused a connection."""
+        out = {}
+        for name, sess in (("api", self.api), ("s3", self.s3)):
+            reqs = conns = 0
+            for adapter in {id(a): a for a in sess.adapters.values()}.values():
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    reqs  += pool.num_requests
+                    conns += pool.num_connections
+            out[name] = {"requests": reqs, "connections": conns, "reused": max(reqs - conns, 0)}
+        return out
+
+    def close(self):
+        self.api.close()
+        self.s3.close()
+
+def _chunk_size_arg(v):
+    if v == "auto": return v
+    try:
+        kib = int(v)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected KiB or 'auto', got {v!r}")
+    if kib < 4: raise argparse.ArgumentTypeError("must be at least 4 KiB")
+    return kib * 1024
+
 def parse_args():
     ap = argparse.ArgumentParser(description="Upload a file to BookFusion like the Calibre plugin.")
-    ap.add_argument("file", help="Path to book file (.pdf/.epub/.mobi/.azw3)")
+    ap.add_argument("paths", nargs="*", metavar="file",
+                    help="Path to book file (.pdf/.epub/.mobi/.azw3). Several files, directories or glob patterns switch to batch mode.")
+    ap.add_argument("--manifest", help="Batch mode: file listing the books ('-' for stdin): one path per line, or JSON lines / "
+                                       "CSV rows with a path plus per-book title, summary, lang, isbn, issued_on, series, "
+                                       "authors, tags, shelves and cover")
+    ap.add_argument("--manifest-format", choices=("auto", "paths", "jsonl", "csv"), default="auto",
+                    help="'auto' goes by extension (.jsonl/.ndjson/.json, .csv, anything else a path list); stdin is a path list (default: auto)")
+    ap.add_argument("--calibre-library", metavar="DIR",
+                    help="Batch mode: upload the books of a Calibre library (the folder holding metadata.db) with the "
+                         "metadata and covers Calibre has for them; the database is only read")
+    ap.add_argument("--calibre-formats", type=lambda v: tuple(f.strip().upper() for f in v.split(",") if f.strip()),
+                    default=CALIBRE_FORMATS, metavar="FMT,...",
+                    help=f"--calibre-library: format to upload when a book has several, in order of preference (default: {','.join(CALIBRE_FORMATS)})")
+    ap.add_argument("-j","--jobs", type=int, default=1, help="Batch mode: books uploaded concurrently (default: 1)")
+    ap.add_argument("--schedule", choices=("input", "size"), default="input",
+                    help="Batch mode: 'input' starts books in input order and streams the inputs; 'size' stats every book first "
+                         "and starts the largest ones first, with a separate lane for books over --large-mb, printing each "
+                         "result as its book finishes (default: input)")
+    ap.add_argument("--large-mb", type=int, default=64, metavar="MB", help="--schedule size: books at least this big go to the large lane (default: 64)")
+    ap.add_argument("--large-jobs", type=int, metavar="N", help="--schedule size: jobs reserved for the large lane (default: --jobs / 4, at least 1)")
+    ap.add_argument("--api-concurrency", type=int, metavar="N", help="Max in-flight init/finalize calls across all jobs (default: --jobs)")
+    ap.add_argument("--s3-concurrency",  type=int, metavar="N", help="Max in-flight S3 uploads across all jobs (default: --jobs)")
+    ap.add_argument("--adaptive", action="store_true",
+                    help="Batch mode: tune in-flight API calls and S3 uploads on the fly (AIMD on latency and 429/503); "
+                         "--api-concurrency/--s3-concurrency (default: --jobs) become upper bounds")
+    ap.add_argument("--pool-size", type=int, metavar="N", help="Keep-alive connections kept per host (default: max(10, concurrency))")
+    ap.add_argument("--s3-bandwidth", type=float, metavar="MB/s", help="Cap on combined S3 upload bandwidth (default: unlimited)")
+    ap.add_argument("--api-rate", type=float, metavar="N", help="Cap on BookFusion API requests per second, retries included (default: unlimited)")
+    ap.add_argument("--rate-file", metavar="PATH",
+                    help="Rate control file ('s3_bandwidth = MB/s', 'api_rate = N' lines) overriding the two caps above; "
+                         "re-read whenever it changes and on SIGHUP")
+    ap.add_argument("--retries", type=int, default=4, metavar="N", help="Attempts per phase on connection errors, 429 and 5xx (default: 4; 1 disables retrying)")
+    ap.add_argument("--retry-delay", type=float, default=0.5, metavar="SECS", help="Base backoff delay, doubled per attempt with full jitter (default: 0.5)")
+    ap.add_argument("--retry-max-delay", type=float, default=30.0, metavar="SECS", help="Backoff cap, unless Retry-After asks for longer (default: 30)")
+    ap.add_argument("--retry-budget", type=int, metavar="N", help="Total retries allowed for the whole run (default: unlimited)")
+    ap.add_argument("--connect-timeout", type=float, default=CONNECT_TIMEOUT, metavar="SECS",
+                    help=f"Give up connecting to a host after this long (default: {CONNECT_TIMEOUT:g})")
+    ap.add_argument("--read-timeout", type=float, default=READ_TIMEOUT, metavar="SECS",
+                    help=f"Give up on a connection that sends or receives nothing for this long; "
+                         f"not a cap on the whole request, so large uploads aren't cut off (default: {READ_TIMEOUT:g})")
+    ap.add_argument("--async", dest="use_async", action="store_true",
+                    help="Batch mode: drive uploads from one asyncio event loop (needs aiohttp); --jobs is then the number of books in flight")
+    ap.add_argument("--hash-workers", type=int, default=min(4, os.cpu_count() or 1), metavar="N",
+                    help="Batch mode: books hashed in parallel by the hashing stage ahead of the uploads (default: min(4, CPUs))")
+    ap.add_argument("--hash-procs", action="store_true",
+                    help="Hash in worker processes instead of threads (if profiling shows hashing is CPU-bound)")
+    ap.add_argument("--hash-method", choices=HASH_METHODS, default="auto",
+                    help="How files are read for hashing: mmap, readinto (one reused buffer), read (plain loop), or auto = mmap for local regular files, readinto otherwise (default: auto)")
+    ap.add_argument("--chunk-size", type=_chunk_size_arg, metavar="KiB|auto",
+                    help="Read size for hashing and S3 uploads. 'auto' measures read throughput on the first file of each "
+                         "mount point and remembers the best size in --state-db (default: 1024 for hashing, 256 for uploads)")
+    ap.add_argument("--hash-queue", type=int, metavar="N",
+                    help="Hashed books allowed to wait for an upload slot (default: 2 x --jobs)")
+    ap.add_argument("--single-pass", action="store_true",
+                    help="Read each book once: hash it into a spool and upload from there. In batch mode the next book is hashed while the current one uploads.")
+    ap.add_argument("--spool-max", type=int, default=SPOOL_MAX_MB, metavar="MB",
+                    help=f"--single-pass: bytes kept in RAM per book before spilling to a temp file (default: {SPOOL_MAX_MB})")
+    ap.add_argument("--spool-budget", type=int, default=SPOOL_BUDGET_MB, metavar="MB",
+                    help=f"--single-pass batches: RAM all spools together may hold; books beyond it spool to a temp file (default: {SPOOL_BUDGET_MB})")
+    ap.add_argument("--state-db", default=str(STATE_DB_DEFAULT), metavar="PATH",
+                    help=f"Local state database holding the digest cache and upload ledger (default: {STATE_DB_DEFAULT})")
+    ap.add_argument("--no-digest-cache", action="store_true", help="Don't read or write the digest cache")
+    ap.add_argument("--rehash", action="store_true", help="Ignore cached digests and hash every book again (refreshes the cache)")
+    ap.add_argument("--no-ledger", action="store_true", help="Don't consult or update the local upload ledger")
+    ap.add_argument("--force", action="store_true", help="Upload even if the ledger says the book is already on BookFusion")
+    ap.add_argument("--metadata-only", action="store_true",
+                    help="Never send book files, only finalize changed metadata of books the ledger knows (e.g. bulk retagging); "
+                         "other books fail with 'not uploaded yet'")
+    ap.add_argument("--journal", metavar="PATH",
+                    help="Batch mode: phase journal; rerunning with the same journal resumes an interrupted batch where each book left off")
+    ap.add_argument("--prune-cache", nargs="?", type=float, const=0, metavar="DAYS",
+                    help="Drop digest-cache entries for files that are gone or changed (and, with DAYS, unused for that long), compact the database and exit")
+    ap.add_argument("--metrics", metavar="PATH",
+                    help="Append JSON-lines events (one per book with per-phase timings, bytes and retries, then a summary) to PATH ('-' for stderr)")
+    ap.add_argument("--prometheus", metavar="PATH",
+                    help="Keep a Prometheus text-format file (node_exporter textfile collector) with phase histograms and counters at PATH")
+    ap.add_argument("--statsd", metavar="HOST:PORT", help="Send per-book phase timers and counters to a StatsD server over UDP")
     ap.add_argument("--api-key", help="BookFusion Calibre API key. If omitted, reads env BF_API_KEY or --api-key-file.")
     ap.add_argument("--api-key-file", help="File containing API key (first line).")
     ap.add_argument("--api-base", default=API_BASE_DEFAULT, help=f"API base (default: {API_BASE_DEFAULT})")
     # Metadata (all optional; server accepts sparse metadata)
-    ap.add_argument("--title",   help="Title (default: filename stem)")
+    ap.add_argument("--title",   help="Title (default: the title embedded in the book, else the filename stem)")
     ap.add_argument("--summary", help="Description/summary")
     ap.add_argument("--lang",    help="Language code (e.g., eng)")
     ap.add_argument("--isbn",    help="ISBN")
@@ -94,9 +925,41 @@ def parse_args():
     ap.add_argument("--author", action="append", dest="authors", help="Repeatable.")
     ap.add_argument("--tag",    action="append", dest="tags",    help="Repeatable.")
     ap.add_argument("--shelf",  action="append", dest="shelves", help="Repeatable. If any provided, bookshelves array is sent.")
-    ap.add_argument("--cover",  help="Path to cover image to attach")
+    ap.add_argument("--cover",  help="Path to cover image to attach (default: the cover embedded in the book, if any)")
+    ap.add_argument("--no-embedded-meta", action="store_true",
+                    help="Don't read metadata/cover from the book file (EPUB OPF, PDF Info/XMP, MOBI/AZW3 EXTH); only the flags above and the file name are used")
+    ap.add_argument("--pdf-cover", action="store_true",
+                    help="Use the largest JPEG on a PDF's first page (typically the scanned cover) as its cover")
     ap.add_argument("-v","--verbose", action="store_true", help="Verbose logs")
-    return ap.parse_args()
+    args = ap.parse_args()
+    if not args.paths and not args.manifest and not args.calibre_library and args.prune_cache is None:
+        ap.error("a book file, directory, glob pattern, --manifest or --calibre-library is required")
+    if args.calibre_library:
+        lib = Path(args.calibre_library).expanduser()
+        if not (lib / "metadata.db").is_file() and not (lib.is_file() and lib.name.endswith(".db")):
+            ap.error(f"--calibre-library: no metadata.db in {lib}")
+    if not args.calibre_formats or set(args.calibre_formats) - set(CALIBRE_FORMATS):
+        ap.error(f"--calibre-formats takes a list of {', '.join(CALIBRE_FORMATS)}")
+    if args.metadata_only and args.single_pass:
+        ap.error("--metadata-only sends no file, so --single-pass has nothing to do")
+    if args.hash_procs and args.single_pass:
+        ap.error("--single-pass spools in this process, so it can't hash in worker processes (--hash-procs)")
+    if args.use_async:
+        if aiohttp is None: ap.error("--async needs aiohttp (pip install aiohttp)")
+        # No hashing stage or size lanes on the event loop for these to tune
+        for opt in ("single_pass", "journal", "metadata_only", "hash_queue", "large_jobs"):
+            if getattr(args, opt): ap.error(f"--async can't be combined with --{opt.replace('_','-')}")
+    for opt in ("connect_timeout", "read_timeout"):
+        if getattr(args, opt) <= 0: ap.error(f"--{opt.replace('_','-')} must be > 0")
+    for opt in ("s3_bandwidth", "api_rate"):
+        if (getattr(args, opt) or 0) < 0: ap.error(f"--{opt.replace('_','-')} can't be negative")
+    if args.statsd and not args.statsd.rpartition(":")[2].isdigit():
+        ap.error("--statsd expects HOST:PORT")
+    for opt in ("jobs", "api_concurrency", "s3_concurrency", "pool_size", "spool_max", "spool_budget", "retries", "hash_workers", "hash_queue",
+                "large_mb", "large_jobs"):
+        v = getattr(args, opt)
+        if v is not None and v < 1: ap.error(f"--{opt.replace('_','-')} must be >= 1")
+    return args
 
 def load_api_key(args):
     if args.api_key: return args.api_key.strip()
@@ -107,32 +970,148 @@ def load_api_key(args):
     print("No API key. Use --api-key, --api-key-file, or set BF_API_KEY.", file=sys.stderr)
     sys.exit(2)
 
-def do_init(api_base, auth, filename, file_digest, verbose=False):
+class HTTPStatusError(RuntimeError):
+    """A phase got an unexpected HTTP status. Keeps the response so callers can retry or report it."""
+    def __init__(self, msg, response):
+        super().__init__(msg)
+        self.response = response
+        self.status = response.status_code
+        self.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+def parse_retry_after(value):
+    """Retry-After as seconds to wait (delta-seconds or HTTP-date), None if absent/unparseable."""
+    if not value: return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+# Connection failures and timeouts from either client (requests, or aiohttp with --async)
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, asyncio.TimeoutError) + \
+                   ((aiohttp.ClientConnectionError,) if aiohttp is not None else ())
+
+class RetryPolicy:
+    """
+    Retries for one phase at a time on transient failures (connection errors,
+    timeouts, 408/429/5xx): exponential backoff with full jitter, Retry-After
+    honoured, and an optional retry budget shared by the whole run so a dead
+    endpoint fails the batch quickly instead of retrying every book.
+    """
+    RETRY_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+    def __init__(self, attempts=4, base_delay=0.5, max_delay=30.0, budget=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.lock = threading.Lock()
+
+    def retryable(self, exc):
+        if isinstance(exc, TRANSIENT_ERRORS): return True
+        return isinstance(exc, HTTPStatusError) and exc.status in self.RETRY_STATUS
+
+    def delay(self, attempt, retry_after=None):
+        d = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        return max(d, retry_after or 0.0)
+
+    def _spend(self):
+        with self.lock:
+            if self.budget is None: return True
+            if self.budget <= 0: return False
+            self.budget -= 1
+            return True
+
+    def _backoff(self, phase, e, attempt, tries, retryable, verbose):
+        # Seconds to wait before the next attempt, or None to give up and re-raise
+        if not (retryable or self.retryable)(e) or attempt >= self.attempts or not self._spend():
+            return None
+        d = self.delay(attempt, getattr(e, "retry_after", None))
+        if verbose: print(f"    {phase} attempt {attempt} failed ({e}); retrying in {d:.1f}s")
+        if tries is not None: tries[phase] = tries.get(phase, 0) + 1
+        return d
+
+    def call(self, phase, fn, tries=None, retryable=None, verbose=False):
+        """Run fn(), retrying it per the policy. `tries` (a dict) counts retries per phase."""
+        attempt = 1
+        while True:
+            try:
+                return fn()
+            except Exception as e:
+                d = self._backoff(phase, e, attempt, tries, retryable, verbose)
+                if d is None: raise
+            time.sleep(d)
+            attempt += 1
+
+    async def acall(self, phase, fn, tries=None, retryable=None, verbose=False):
+        """call() for coroutine functions; waits with asyncio.sleep."""
+        attempt = 1
+        while True:
+            try:
+                return await fn()
+            except Exception as e:
+                d = self._backoff(phase, e, attempt, tries, retryable, verbose)
+                if d is None: raise
+            await asyncio.sleep(d)
+            attempt += 1
+
+NO_RETRY = RetryPolicy(attempts=1)
+
+def presign_expires_at(s3_params: dict):
+    """Expiry (epoch seconds) of presigned S3 POST params, read from the base64 policy document; None if unknown."""
+    policy = s3_params.get("policy") or s3_params.get("Policy")
+    try:
+        exp = json.loads(base64.b64decode(policy))["expiration"]
+        return datetime.fromisoformat(exp.replace("Z", "+00:00")).timestamp()
+    except Exception:
+        return None
+
+def presign_stale(init, refused=False):
+    """True if init's presigned params expire within a minute, or S3 already `refused` them as expired."""
+    exp = presign_expires_at(init["params"])
+    return refused or (exp is not None and exp - 60 < time.time())
+
+def refused_as_expired(e: "HTTPStatusError"):
+    return e.status == 403 and "expired" in e.response.text.lower()
+
+def ledger_check(ledger, file_digest, meta_digest, force=False):
+    """
+    The sync and async uploads' ledger step: (Entry or None, skip). skip means the
+    book is on BookFusion with this metadata; an Entry without skip only needs a
+    re-finalize against its S3 key.
+    """
+    known = ledger.get(file_digest) if ledger is not None and not force else None
+    return known, bool(known and known.meta_digest == meta_digest)
+
+def do_init(api_base, auth, filename, file_digest, verbose=False, session=requests, timeout=HTTP_TIMEOUT):
     url = f"{api_base}/uploads/init"
     files = {"filename": (None, filename), "digest": (None, file_digest)}
     if verbose: print(f">>> INIT {url}")
-    r = requests.post(url, files=files, auth=auth)
+    r = session.post(url, files=files, auth=auth, timeout=timeout)
     if verbose: print(f"<<< {r.status_code} {r.reason}")
     if r.status_code not in (200, 201):
-        raise RuntimeError(f"init failed: HTTP {r.status_code} - {r.text[:500]}")
+        raise HTTPStatusError(f"init failed: HTTP {r.status_code} - {r.text[:500]}", r)
     data = r.json()
     if "url" not in data or "params" not in data: raise RuntimeError(f"init response missing fields: {data}")
     return data
 
-def do_s3_post(s3_url, s3_params: dict, book_path: Path, verbose=False):
-    # S3 expects all fields from params plus the file part
-    fields = {k: str(v) for k, v in s3_params.items()}
-    files = { **{k:(None,v) for k,v in fields.items()},
-              "file": (book_path.name, open(book_path, "rb"), guess_mimetype(book_path)) }
-    if verbose: print(f">>> S3 POST {s3_url}")
-    r = requests.post(s3_url, files=files)
+def do_s3_post(s3_url, s3_params: dict, book_path: Path, verbose=False, session=requests, source=None, chunk=UPLOAD_CHUNK,
+               limiter=None, timeout=HTTP_TIMEOUT):
+    # S3 expects all fields from params plus the file part (last), streamed from disk (or a spool).
+    # The read timeout bounds each socket operation, so long bodies aren't cut off.
+    body = MultipartFileBody(s3_params, "file", book_path, chunk=chunk, source=source, limiter=limiter)
+    if verbose: print(f">>> S3 POST {s3_url} ({len(body)} bytes)")
+    r = session.post(s3_url, data=body, headers={"Content-Type": body.content_type}, timeout=timeout)
     if verbose: print(f"<<< {r.status_code} {r.reason}")
     if r.status_code != 204:
-        raise RuntimeError(f"S3 upload failed: HTTP {r.status_code} - {r.text[:500]}")
+        raise HTTPStatusError(f"S3 upload failed: HTTP {r.status_code} - {r.text[:500]}", r)
     return True
 
-def do_finalize(api_base, auth, s3_key, file_digest, meta: dict, meta_digest, cover_path=None, verbose=False):
-    url = f"{api_base}/uploads/finalize"
+def finalize_parts(s3_key, file_digest, meta: dict, meta_digest, cover_path: str|Cover|None=None):
+    """Form fields for /uploads/finalize, as a requests files= list."""
     parts = []
     # Required fields
     parts.append(("key", (None, s3_key)))
@@ -158,89 +1137,1830 @@ def do_finalize(api_base, auth, s3_key, file_digest, meta: dict, meta_digest, co
         parts.append(("metadata[bookshelves][]", (None, "")))
         for sh in shelves:
             parts.append(("metadata[bookshelves][]", (None, sh)))
-    if cover_path:
-        cp = Path(cover_path)
-        if cp.is_file():
-            parts.append(("metadata[cover]", (cp.name, open(cp,"rb"), guess_mimetype(cp))))
+    cover = load_cover(cover_path) if cover_path else None
+    if cover:
+        parts.append(("metadata[cover]", (cover.name, cover.data, cover.mimetype)))
+    return parts
+
+def do_finalize(api_base, auth, s3_key, file_digest, meta: dict, meta_digest, cover_path: str|Cover|None=None, verbose=False, session=requests,
+                timeout=HTTP_TIMEOUT):
+    url = f"{api_base}/uploads/finalize"
+    parts = finalize_parts(s3_key, file_digest, meta, meta_digest, cover_path)
     if verbose: print(f">>> FINALIZE {url}")
-    r = requests.post(url, files=parts, auth=auth, headers={"Accept":"application/json"})
+    r = session.post(url, files=parts, auth=auth, headers={"Accept":"application/json"}, timeout=timeout)
     if verbose:
         print(f"<<< {r.status_code} {r.reason}")
         rid = r.headers.get("x-request-id","")
         if rid: print(f"    X-Request-Id: {rid}")
     return r
 
-def main():
-    args = parse_args()
-    path = Path(args.file).expanduser().resolve()
-    if not path.is_file():
-        print(f"File not found: {path}", file=sys.stderr)
-        sys.exit(1)
+class BufferedResponse:
+    """The parts of requests.Response the phase code reads, for responses from the async client."""
+    def __init__(self, status_code, reason, headers, text):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.text = text
 
-    api_key = load_api_key(args)
-    auth = (api_key, "")   # Basic api_key:
+    def json(self):
+        return json.loads(self.text)
+
+class AsyncBFClient:
+    """
+    asyncio counterpart of BFClient, built on aiohttp. init/upload/finalize behave
+    like do_init/do_s3_post/do_finalize, but bodies are streamed without blocking
+    the loop and file reads run in the default thread pool, so a single event
+    loop can keep hundreds of latency-bound uploads in flight.
+    `timeout` is a (connect, read) pair like BFClient's; there is no total cap.
+    Use as `async with AsyncBFClient(api_base, auth) as client: ...`.
+    """
+    def __init__(self, api_base, auth, limit=100, rates=NO_RATES, timeout=HTTP_TIMEOUT):
+        if aiohttp is None:
+            raise RuntimeError("AsyncBFClient needs aiohttp (pip install aiohttp)")
+        self.rates = rates
+        self.api_base = api_base
+        self.auth = {"Authorization": "Basic " + base64.b64encode(f"{auth[0]}:{auth[1]}".encode()).decode()}
+        self.limit = limit
+        self.timeout = timeout
+        self.api = self.s3 = None
+
+    async def __aenter__(self):
+        # aiohttp's default is a 300 s total per request, which would kill long S3 POSTs
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        self.api = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit), timeout=timeout)
+        self.s3  = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit), timeout=timeout)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.api.close()
+        await self.s3.close()
+
+    async def _post(self, session, url, data, headers, auth=None, verbose=False):
+        async with session.post(url, data=data, headers={**headers, **(auth or {})}) as r:
+            text = await r.text(errors="replace")
+        if verbose: print(f"<<< {r.status} {r.reason}")
+        return BufferedResponse(r.status, r.reason, r.headers, text)
+
+    async def init(self, filename, file_digest, verbose=False):
+        url = f"{self.api_base}/uploads/init"
+        body, ctype = encode_multipart([("filename", (None, filename)), ("digest", (None, file_digest))])
+        if verbose: print(f">>> INIT {url}")
+        r = await self._post(self.api, url, body, {"Content-Type": ctype}, self.auth, verbose)
+        if r.status_code not in (200, 201):
+            raise HTTPStatusError(f"init failed: HTTP {r.status_code} - {r.text[:500]}", r)
+        data = r.json()
+        if "url" not in data or "params" not in data: raise RuntimeError(f"init response missing fields: {data}")
+        return data
+
+    async def upload(self, s3_url, s3_params: dict, book_path: Path, verbose=False, source=None, chunk=UPLOAD_CHUNK):
+        body = MultipartFileBody(s3_params, "file", book_path, chunk=chunk, source=source, limiter=self.rates.s3)
+        if verbose: print(f">>> S3 POST {s3_url} ({len(body)} bytes)")
+        # Explicit Content-Length keeps aiohttp from falling back to chunked encoding
+        headers = {"Content-Type": body.content_type, "Content-Length": str(len(body))}
+        r = await self._post(self.s3, s3_url, body.aiter_chunks(), headers, verbose=verbose)
+        if r.status_code != 204:
+            raise HTTPStatusError(f"S3 upload failed: HTTP {r.status_code} - {r.text[:500]}", r)
+        return True
+
+    async def finalize(self, s3_key, file_digest, meta, meta_digest, cover_path=None, verbose=False):
+        url = f"{self.api_base}/uploads/finalize"
+        body, ctype = encode_multipart(finalize_parts(s3_key, file_digest, meta, meta_digest, cover_path))
+        if verbose: print(f">>> FINALIZE {url}")
+        r = await self._post(self.api, url, body, {"Content-Type": ctype, "Accept": "application/json"}, self.auth, verbose)
+        if verbose:
+            rid = r.headers.get("x-request-id","")
+            if rid: print(f"    X-Request-Id: {rid}")
+        return r
+
+    async def upload_book(self, path: Path, meta: dict, cover_path=None, verbose=False, retry=NO_RETRY,
+                          cache=None, rehash=False, ledger=None, force=False, chunks=DEFAULT_CHUNKS, limits=None,
+                          hasher=sha256_file):
+        """
+        upload_book() for the event loop: hash (or cached digest, via prepare_book
+        with `hasher`), ledger check, init -> S3 POST -> finalize with per-phase
+        retries, making the same decisions as the threaded upload_book(). Blocking
+        work (hashing, SQLite, cover read) runs in the default thread pool. `limits`
+        may be an adaptive PhaseLimits gating the API calls and S3 uploads.
+        """
+        api_slot = limits.api_slot if limits else contextlib.nullcontext
+        s3_slot = limits.s3_slot if limits else lambda n: contextlib.nullcontext()
+        prepared = await asyncio.to_thread(prepare_book, path, cache, rehash, hasher=hasher, chunks=chunks)
+        file_digest, bytes_read, size, tries = prepared.digest, prepared.bytes_read, prepared.bytes_read or path.stat().st_size, {}
+        timings = {"hash": prepared.hash_secs}
+        with timed(timings, "meta"):
+            cover = await asyncio.to_thread(load_cover, cover_path)
+            meta_digest = compute_calibre_metadata_digest(meta, cover)
+
+        known, skip = await asyncio.to_thread(ledger_check, ledger, file_digest, meta_digest, force)
+        if skip:
+            return {"ok": True, "action": "skipped", "bookfusion_id": known.bookfusion_id,
+                    "key": known.s3_key, "bytes_read": bytes_read, "ms": phase_ms(timings)}
+
+        async def finalize(s3_key, action):
+            async def phase():
+                await self.rates.api.atake()     # before the slot: a rate wait isn't API latency
+                async with api_slot():
+                    r = await self.finalize(s3_key, file_digest, meta, meta_digest, cover, verbose)
+                    if r.status_code in retry.RETRY_STATUS:
+                        raise HTTPStatusError(f"finalize failed: HTTP {r.status_code} - {r.text[:500]}", r)
+                return r
+            try:
+                with timed(timings, "finalize"):
+                    r = await retry.acall("finalize", phase, tries, verbose=verbose)
+            except HTTPStatusError as e:
+                r = e.response
+            res = await asyncio.to_thread(finalize_result, r, path, s3_key, file_digest, meta_digest, ledger, action, bytes_read)
+            res["ms"] = phase_ms(timings)
+            if tries: res["retries"] = tries
+            return res
+
+        if known:
+            return await finalize(known.s3_key, "metadata")
+
+        async def init_phase():
+            await self.rates.api.atake()
+            async with api_slot():
+                return await self.init(path.name, file_digest, verbose)
+        with timed(timings, "init"):
+            init = await retry.acall("init", init_phase, tries, verbose=verbose)
+        stale = False
+        async def s3_phase():
+            nonlocal init, stale, bytes_read
+            if presign_stale(init, stale):
+                init, stale = await retry.acall("init", init_phase, tries, verbose=verbose), False
+            bytes_read += size
+            try:
+                chunk = await asyncio.to_thread(chunks.upload, path)
+                async with s3_slot(size):
+                    return await self.upload(init["url"], init["params"], path, verbose, chunk=chunk)
+            except HTTPStatusError as e:
+                stale = refused_as_expired(e)
+                raise
+        with timed(timings, "s3"):
+            await retry.acall("s3", s3_phase, tries, retryable=lambda e: stale or retry.retryable(e), verbose=verbose)
+        return await finalize(init["params"].get("key"), "uploaded")
+
+    async def iter_uploads(self, paths, meta_for=None, cover_path=None, jobs=100, ordered=True, **kw):
+        """
+        Async generator over (path, result) in input order (with ordered=False, as
+        each book finishes), with up to `jobs` books in flight. `meta_for(path)`
+        builds each book's meta, or a (meta, cover) pair to override `cover_path`
+        (default: title from the file name); it runs in the default thread pool.
+        Other keywords go to upload_book(). Failures become {"ok": False, "error"}
+        results. Items may also be objects with a .path (such as BatchItem): they
+        are handed to meta_for and yielded back in place of the path.
+        """
+        meta_for = meta_for or (lambda p: {"title": p.stem, "author_list": [], "tag_list": [], "series": [], "bookshelves": None})
+        async def one(path, item):
+            try:
+                if not path.is_file(): raise FileNotFoundError(f"File not found: {path}")
+                meta, cover = await asyncio.to_thread(meta_for, item), cover_path
+                if isinstance(meta, tuple): meta, cover = meta
+                return await self.upload_book(path, meta, cover, **kw)
+            except Exception as e:
+                return {"ok": False, "error": str(e)}
+        it = iter(paths)
+        inflight, finished, nxt, idx = {}, {}, 0, 0
+        while True:
+            while len(inflight) < jobs:
+                item = next(it, None)
+                if item is None: break
+                path = Path(getattr(item, "path", item))
+                if not hasattr(item, "path"): item = path
+                inflight[asyncio.ensure_future(one(path, item))] = (idx, item)
+                idx += 1
+            if not inflight: return
+            done, _ = await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                i, item = inflight.pop(t)
+                finished[i if ordered else nxt + len(finished)] = (item, t.result())
+            while nxt in finished:
+                yield finished.pop(nxt)
+                nxt += 1
+
+    async def upload_many(self, paths, **kw):
+        """Upload every path (see iter_uploads) and return the [(path, result), ...] list in input order."""
+        return [item async for item in self.iter_uploads(paths, **kw)]
+
+def is_batch(args):
+    if args.manifest or args.calibre_library or len(args.paths) != 1: return True
+    p = args.paths[0]
+    return Path(p).expanduser().is_dir() or (glob.has_magic(p) and not Path(p).expanduser().exists())
+
+def iter_manifest_paths(manifest):
+    # One path per line; blank lines and '#' comments skipped. Relative paths resolve against the manifest's directory.
+    f = sys.stdin if manifest == "-" else open(manifest, encoding="utf-8")
+    base = Path.cwd() if manifest == "-" else Path(manifest).expanduser().resolve().parent
+    with f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"): continue
+            yield base / Path(line).expanduser()
+
+# JSONL/CSV manifest keys -> parse_args dests (CLI flag names and their plurals both work)
+MANIFEST_FIELDS = {"path": "path", "title": "title", "summary": "summary", "lang": "lang", "isbn": "isbn",
+                   "issued_on": "issued_on", "series": "series", "author": "authors", "authors": "authors",
+                   "tag": "tags", "tags": "tags", "shelf": "shelves", "shelves": "shelves", "cover": "cover"}
+MANIFEST_LISTS = {"series", "authors", "tags", "shelves"}
+MANIFEST_ERRORS_SHOWN = 20
+
+def manifest_format(manifest, fmt="auto"):
+    # 'auto': by extension; stdin is a plain path list unless --manifest-format says otherwise
+    if fmt != "auto": return fmt
+    ext = "" if manifest == "-" else Path(manifest).suffix.lower()
+    return "jsonl" if ext in (".jsonl", ".ndjson", ".json") else "csv" if ext == ".csv" else "paths"
+
+def _open_manifest(manifest):
+    # (file, directory relative paths resolve against); stdin arrives spooled to a temp file
+    if hasattr(manifest, "read"):
+        manifest.seek(0)
+        return contextlib.nullcontext(manifest), Path.cwd()
+    p = Path(manifest).expanduser().resolve()
+    return open(p, encoding="utf-8-sig", newline=""), p.parent
+
+def _manifest_rows(f, fmt):
+    # (line number, JSON text or CSV row dict) per record
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader: yield reader.line_num, row
+        return
+    for n, line in enumerate(f, 1):
+        line = line.strip()
+        if line and not line.startswith("#"): yield n, line
+
+def manifest_fields(raw, base: Path, check=True):
+    """
+    (path, fields) from one JSONL line or CSV row. fields holds per-book values for
+    the metadata flags under their parse_args dests (authors, tags, shelves, series,
+    ...); list fields take a list or a ';'-separated string, series entries are
+    'Title[:index]' or {"title", "index"}. Raises ValueError on anything the upload
+    would trip over, including (with check) a book or cover file that doesn't exist.
+    """
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"invalid JSON ({e.msg})")
+        if not isinstance(raw, dict): raise ValueError("expected a JSON object")
+    elif None in raw:
+        raise ValueError("more columns than the header")
+    fields = {}
+    for key, value in raw.items():
+        name = MANIFEST_FIELDS.get(key.strip().lower().replace("-", "_"))
+        if name is None: raise ValueError(f"unknown field {key!r}")
+        if value is None or value == "" or value == []: continue
+        if name in MANIFEST_LISTS:
+            items = [v.strip() for v in value.split(";")] if isinstance(value, str) else value if isinstance(value, list) else [value]
+            out = []
+            for v in items:
+                if name == "series" and isinstance(v, dict):
+                    idx = v.get("index")
+                    if not isinstance(v.get("title"), str) or not v["title"].strip(): raise ValueError("series entry without a title")
+                    if idx is not None and (isinstance(idx, bool) or not isinstance(idx, (int, float))):
+                        raise ValueError(f"series index must be a number, got {idx!r}")
+                    out.append({"title": v["title"].strip(), "index": idx})
+                elif isinstance(v, str):
+                    if not v.strip(): continue
+                    if name == "series" and ":" in v:
+                        try:
+                            float(v.split(":", 1)[1])
+                        except ValueError:
+                            raise ValueError(f"series index must be a number in {v!r} (use {{\"title\", \"index\"}} for titles with ':')")
+                    out.append(v.strip())
+                else:
+                    raise ValueError(f"{key} must be a string or a list of strings")
+            if out: fields[name] = out
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)): raise ValueError(f"{key} must be a string")
+        value = str(value).strip()
+        if not value: continue
+        if name == "issued_on":
+            try:
+                if not re.fullmatch(r"\d{4}-\d\d-\d\d", value): raise ValueError
+                date.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"issued_on must be YYYY-MM-DD, got {value!r}")
+        elif name == "isbn" and not norm_isbn(value):
+            raise ValueError(f"not an ISBN: {value!r}")
+        elif name in ("path", "cover"):
+            # os.path rather than pathlib: this runs once per record of possibly millions
+            value = os.path.normpath(os.path.join(base, os.path.expanduser(value)))
+            if check and not os.path.isfile(value): raise ValueError(f"{name} not found: {value}")
+        fields[name] = value
+    if "path" not in fields: raise ValueError("no path")
+    return Path(fields.pop("path")), fields
+
+def iter_manifest_records(manifest, fmt):
+    """(path, fields) per record of a JSONL/CSV manifest, parsed lazily; see check_manifest for validation."""
+    opened, base = _open_manifest(manifest)
+    with opened as f:
+        for n, raw in _manifest_rows(f, fmt):
+            try:
+                yield manifest_fields(raw, base, check=False)
+            except ValueError as e:
+                raise ValueError(f"manifest line {n}: {e}") from None
+
+def check_manifest(manifest, fmt):
+    """
+    Validate every record of a JSONL/CSV manifest in one streaming pass, before
+    anything is uploaded. Returns (records, invalid, first MANIFEST_ERRORS_SHOWN messages).
+    """
+    records = invalid = 0
+    errors = []
+    opened, base = _open_manifest(manifest)
+    with opened as f:
+        for n, raw in _manifest_rows(f, fmt):
+            records += 1
+            try:
+                manifest_fields(raw, base)
+            except ValueError as e:
+                invalid += 1
+                if len(errors) < MANIFEST_ERRORS_SHOWN: errors.append(f"manifest line {n}: {e}")
+    return records, invalid, errors
 
-    title = args.title or path.stem
+def iter_book_paths(inputs, manifest=None):
+    """
+    Expand CLI inputs into book files, lazily and in a stable order:
+      files as given, directories walked recursively (sorted), glob patterns (sorted),
+      then manifest entries. Only BOOK_EXTS are picked up from directories and globs;
+      explicitly named files are passed through. Duplicates are dropped.
+    """
+    seen = set()
+    def expand(p: Path, explicit):
+        if p.is_dir():
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                for n in sorted(files):
+                    if n.lower().endswith(BOOK_EXTS): yield Path(root, n)
+        elif explicit or p.suffix.lower() in BOOK_EXTS:
+            yield p
+    def sources():
+        for item in inputs:
+            p = Path(item).expanduser()
+            if glob.has_magic(item) and not p.exists():
+                for m in sorted(glob.glob(os.path.expanduser(item), recursive=True)):
+                    yield from expand(Path(m), False)
+            else:
+                yield from expand(p, True)
+        if manifest:
+            for p in iter_manifest_paths(manifest):
+                yield from expand(p, True)
+    for p in sources():
+        p = p.resolve()
+        if p in seen: continue
+        seen.add(p)
+        yield p
+
+BookEntry = namedtuple("BookEntry", "meta cover fields", defaults=(None, None, None))
+
+def iter_batch_books(args):
+    """
+    (path, BookEntry or None) for a batch run: CLI inputs, then the manifest, then
+    the --calibre-library books. Records from a JSONL/CSV manifest or a Calibre
+    library carry their own BookEntry for book_meta, so each is uploaded with its
+    own metadata even if the same file turns up again.
+    """
+    fmt = manifest_format(args.manifest, args.manifest_format) if args.manifest else None
+    for path in iter_book_paths(args.paths, args.manifest if fmt == "paths" else None):
+        yield path, None
+    if fmt in ("jsonl", "csv"):
+        for path, fields in iter_manifest_records(args.manifest, fmt):
+            yield path, BookEntry(fields=fields)
+    if args.calibre_library:
+        for path, meta, cover in iter_calibre_library(args.calibre_library, args.calibre_formats, args.verbose):
+            yield path, BookEntry(meta, cover)
+
+# ISO 639-1 -> the 3-letter codes Calibre (and so BookFusion) uses
+LANG3 = {"en": "eng", "fr": "fra", "de": "deu", "es": "spa", "it": "ita", "pt": "por", "nl": "nld", "ru": "rus",
+         "pl": "pol", "sv": "swe", "da": "dan", "nb": "nob", "nn": "nno", "no": "nor", "fi": "fin", "cs": "ces",
+         "sk": "slk", "hu": "hun", "ro": "ron", "el": "ell", "tr": "tur", "uk": "ukr", "bg": "bul", "hr": "hrv",
+         "sr": "srp", "sl": "slv", "et": "est", "lv": "lav", "lt": "lit", "ca": "cat", "eu": "eus", "gl": "glg",
+         "ga": "gle", "cy": "cym", "is": "isl", "ar": "ara", "he": "heb", "fa": "fas", "hi": "hin", "bn": "ben",
+         "ur": "urd", "zh": "zho", "ja": "jpn", "ko": "kor", "vi": "vie", "th": "tha", "id": "ind", "ms": "msa",
+         "la": "lat", "eo": "epo", "af": "afr", "sw": "swa"}
+
+META_ERRORS = (OSError, ValueError, KeyError, IndexError, struct.error, zlib.error, zipfile.BadZipFile, ET.ParseError)
+
+def norm_language(value):
+    code = (value or "").strip().lower().replace("_", "-").split("-")[0]
+    if not code or code in ("und", "zxx", "mul"): return None
+    return LANG3.get(code, code)
+
+def norm_isbn(value):
+    """ISBN-10/13 digits from an identifier like 'urn:isbn:978-3-16-148410-0', else None."""
+    digits = re.sub(r"[^0-9Xx]", "", re.sub(r"^\s*(urn:)?isbn:?", "", value or "", flags=re.I)).upper()
+    return digits if len(digits) in (10, 13) and "X" not in digits[:-1] else None
+
+def norm_date(value):
+    """'2019', '2019-05', '2019-05-03T00:00:00Z', ... -> 'YYYY-MM-DD' (None if no plausible year)."""
+    m = re.match(r"\s*(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?", value or "")
+    if not m or int(m.group(1)) < 1000: return None      # Calibre writes 0101-01-01 for "unknown"
+    return f"{m.group(1)}-{int(m.group(2) or 1):02d}-{int(m.group(3) or 1):02d}"
+
+def norm_index(value):
+    # Series index as Calibre stores it, always a float (1.0, 2.5): the digest hashes
+    # str(index), so embedded and --calibre-library metadata must agree on "1.0"
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _local(name):
+    return name.rsplit("}", 1)[-1].split(":")[-1]
+
+def _attr(el, name):
+    for k, v in el.attrib.items():
+        if _local(k) == name: return v
+    return None
+
+def read_epub_meta(path, cover=True):
+    """
+    Metadata and cover from an EPUB without unpacking it: container.xml -> OPF,
+    then (if cover) the cover image named by the OPF; no other member is decompressed.
+    Returns (meta, Cover or None); meta only holds the fields found (title,
+    summary, language, isbn, issued_on, author_list, tag_list, series).
+    """
+    with zipfile.ZipFile(path) as z:
+        container = ET.fromstring(z.read("META-INF/container.xml"))
+        opf_path = next(_attr(el, "full-path") for el in container.iter() if _local(el.tag) == "rootfile")
+        opf = ET.fromstring(z.read(opf_path))
+        md = next((el for el in opf.iter() if _local(el.tag) == "metadata"), None)
+        manifest = {_attr(it, "id"): it for it in opf.iter() if _local(it.tag) == "item"}
+        meta, refines, props, creators, ids = {}, {}, {}, [], []
+        for el in (md if md is not None else []):
+            tag, text = _local(el.tag), (el.text or "").strip()
+            if tag == "meta":
+                if _attr(el, "refines"):
+                    refines.setdefault(_attr(el, "refines").lstrip("#"), {})[_attr(el, "property")] = text
+                elif _attr(el, "name"):
+                    props[_attr(el, "name")] = _attr(el, "content") or ""
+                elif _attr(el, "property"):
+                    props.setdefault(_attr(el, "property"), (text, _attr(el, "id")))
+            elif not text:
+                continue
+            elif tag == "title": meta.setdefault("title", text)
+            elif tag == "creator": creators.append((text, _attr(el, "role"), _attr(el, "id")))
+            elif tag == "description": meta.setdefault("summary", text)
+            elif tag == "language": meta.setdefault("language", norm_language(text))
+            elif tag == "date" and _attr(el, "event") in (None, "publication"): meta.setdefault("issued_on", norm_date(text))
+            elif tag == "subject": meta.setdefault("tag_list", []).append(text)
+            elif tag == "identifier": ids.append((_attr(el, "scheme") or "", text))
+
+        # EPUB3 puts roles in refines; anyone without a role counts as an author
+        roles = [(name, role or refines.get(i, {}).get("role")) for name, role, i in creators]
+        authors = [n for n, r in roles if r in (None, "aut")] or [n for n, _ in roles]
+        if authors: meta["author_list"] = authors
+        isbn = next((norm_isbn(v) for sch, v in ids if sch.lower() == "isbn" and norm_isbn(v)), None) \
+            or next((norm_isbn(v) for _, v in ids if v.lower().startswith(("urn:isbn:", "isbn:")) and norm_isbn(v)), None)
+        if isbn: meta["isbn"] = isbn
+        if props.get("calibre:series"):
+            meta["series"] = [{"title": props["calibre:series"], "index": norm_index(props.get("calibre:series_index"))}]
+        elif "belongs-to-collection" in props:
+            name, cid = props["belongs-to-collection"]
+            meta["series"] = [{"title": name, "index": norm_index(refines.get(cid, {}).get("group-position"))}]
+        meta = {k: v for k, v in meta.items() if v}
+        if not cover: return meta, None
+
+        # Cover: EPUB3 cover-image property, EPUB2 <meta name="cover">, then an image item called "cover"
+        # (childless Elements are falsy, hence the explicit None checks)
+        candidates = ([it for it in manifest.values() if "cover-image" in (_attr(it, "properties") or "").split()]
+                      + [manifest.get(props.get("cover"))]
+                      + [it for i, it in manifest.items() if i and "cover" in i.lower()
+                         and (_attr(it, "media-type") or "").startswith("image/")])
+        item = next((it for it in candidates if it is not None), None)
+        if item is not None and (_attr(item, "media-type") or "").startswith("image/"):
+            href = posixpath.normpath(posixpath.join(posixpath.dirname(opf_path), unquote(_attr(item, "href"))))
+            with contextlib.suppress(KeyError):
+                return meta, Cover(posixpath.basename(href), z.read(href), _attr(item, "media-type"))
+    return meta, None
+
+# --- PDF: just enough object syntax to follow startxref -> xref -> Info / XMP / first page ---
+
+PdfRef = namedtuple("PdfRef", "num gen")
+PDF_TAIL = 4096                        # startxref sits in the last 1 KB by spec; leave room for trailing junk
+PDF_COVER_MIN_PX = 300
+_PDF_WS = b"\x00\t\n\x0c\r "
+_PDF_DELIM = _PDF_WS + b"()<>[]{}/%"
+_PDF_ESC = {ord("n"): b"\n", ord("r"): b"\r", ord("t"): b"\t", ord("b"): b"\b", ord("f"): b"\f"}
+_PDF_NUM = re.compile(rb"[+-]?(\d+\.?\d*|\.\d+)")
+_PDF_REF = re.compile(rb"\s+(\d+)\s+R(?=[\x00\t\n\x0c\r ()<>\[\]{}/%])")
+_DC = "{http://purl.org/dc/elements/1.1/}"
+
+class _Truncated(ValueError):
+    """Ran off the end of the buffer: read a bigger window and parse again."""
+
+def _pdf_skip(buf, i):
+    n = len(buf)
+    while i < n:
+        if buf[i] in _PDF_WS: i += 1
+        elif buf[i] == 0x25:                                   # % comment
+            while i < n and buf[i] not in b"\r\n": i += 1
+        else: return i
+    raise _Truncated
+
+def _pdf_token(buf, i):
+    j = i
+    while j < len(buf) and buf[j] not in _PDF_DELIM: j += 1
+    if j == len(buf): raise _Truncated
+    return buf[i:j], j
+
+def _pdf_string(buf, i):
+    out, depth, n = bytearray(), 1, len(buf)
+    while i < n:
+        c = buf[i]; i += 1
+        if c == 0x5C and i < n:                                # backslash escape
+            c = buf[i]; i += 1
+            if c in _PDF_ESC: out += _PDF_ESC[c]
+            elif 0x30 <= c <= 0x37:
+                j = i - 1
+                while i < n and i - j < 3 and 0x30 <= buf[i] <= 0x37: i += 1
+                out.append(int(buf[j:i], 8) & 0xFF)
+            elif c == 0x0D:                                    # line continuation
+                if buf[i:i+1] == b"\n": i += 1
+            elif c != 0x0A: out.append(c)
+        elif c == 0x28: depth += 1; out.append(c)
+        elif c == 0x29:
+            depth -= 1
+            if not depth: return bytes(out), i
+            out.append(c)
+        else: out.append(c)
+    raise _Truncated
+
+def _pdf_value(buf, i):
+    """One PDF object at buf[i:] -> (value, end). Names are str, strings bytes, refs PdfRef."""
+    i = _pdf_skip(buf, i)
+    c = buf[i]
+    if c == 0x2F:                                              # /Name
+        tok, j = _pdf_token(buf, i + 1)
+        return re.sub(rb"#([0-9A-Fa-f]{2})", lambda m: bytes([int(m[1], 16)]), tok).decode("latin-1"), j
+    if buf.startswith(b"<<", i):
+        d, i = {}, i + 2
+        while True:
+            i = _pdf_skip(buf, i)
+            if buf.startswith(b">>", i): return d, i + 2
+            k, i = _pdf_value(buf, i)
+            if not isinstance(k, str): raise ValueError("PDF dictionary key is not a name")
+            d[k], i = _pdf_value(buf, i)
+    if c == 0x5B:                                              # [array]
+        a, i = [], i + 1
+        while True:
+            i = _pdf_skip(buf, i)
+            if buf[i] == 0x5D: return a, i + 1
+            v, i = _pdf_value(buf, i)
+            a.append(v)
+    if c == 0x28: return _pdf_string(buf, i + 1)
+    if c == 0x3C:                                              # <hex string>
+        j = buf.find(b">", i)
+        if j < 0: raise _Truncated
+        h = re.sub(rb"\s", b"", buf[i+1:j])
+        return bytes.fromhex((h + b"0" * (len(h) % 2)).decode("ascii")), j + 1
+    tok, j = _pdf_token(buf, i)
+    if not tok: raise ValueError(f"unexpected {buf[i:i+1]!r} in PDF")
+    if _PDF_NUM.fullmatch(tok):
+        if b"." in tok: return float(tok), j
+        m = _PDF_REF.match(buf, j)
+        return (PdfRef(int(tok), int(m[1])), m.end()) if m else (int(tok), j)
+    return {b"true": True, b"false": False, b"null": None}.get(tok, tok), j
+
+def _png_unpredict(data, columns, colors=1, bpc=8):
+    # PNG row filters (/Predictor 10-15), as used by most xref and object streams
+    bpp, row = max(1, colors * bpc // 8), (columns * colors * bpc + 7) // 8
+    out, prev = bytearray(), bytes(row)
+    for r in range(0, len(data) - row, row + 1):
+        ft, line = data[r], bytearray(data[r + 1:r + 1 + row])
+        if ft == 1:
+            for x in range(bpp, row): line[x] = (line[x] + line[x - bpp]) & 255
+        elif ft == 2:
+            line = bytearray((a + b) & 255 for a, b in zip(line, prev))
+        elif ft == 3:
+            for x in range(row): line[x] = (line[x] + ((line[x - bpp] if x >= bpp else 0) + prev[x]) // 2) & 255
+        elif ft == 4:
+            for x in range(row):
+                a, b, c = (line[x - bpp] if x >= bpp else 0), prev[x], (prev[x - bpp] if x >= bpp else 0)
+                pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+                line[x] = (line[x] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 255
+        out += line; prev = line
+    return bytes(out)
+
+class PdfReader:
+    """
+    Random access to a PDF's objects through its cross-reference data. Only the
+    tail, the xref sections (classic tables are looked up entry by entry, never
+    read whole) and the objects actually asked for are read, so cost doesn't grow
+    with the file size.
+    """
+    def __init__(self, f):
+        self.f, self.size = f, os.fstat(f.fileno()).st_size
+        self.sections, self.trailer, self.cache, self.objstms = [], {}, {}, {}
+        tail = self._read(max(0, self.size - PDF_TAIL), PDF_TAIL)
+        k = tail.rfind(b"startxref")
+        if k < 0: raise ValueError("not a PDF (no startxref)")
+        off, seen = _pdf_value(tail + b"\n", k + 9)[0], set()
+        while isinstance(off, int) and off not in seen:        # newest section first, then /Prev
+            seen.add(off)
+            trailer = self._load_xref(off)
+            if isinstance(trailer.get("XRefStm"), int):       # hybrid file: table + xref stream
+                self._load_xref(trailer["XRefStm"])
+            for k, v in trailer.items(): self.trailer.setdefault(k, v)
+            off = trailer.get("Prev")
+
+    def _read(self, off, n):
+        self.f.seek(off)
+        return self.f.read(n)
+
+    def _parse_at(self, off, window=8192):
+        """(value, buffer, end index in buffer) of the object at file offset off."""
+        while window <= 16 * 1024 * 1024:
+            buf = self._read(off, window)
+            eof = off + len(buf) >= self.size
+            if eof: buf += b"\n"
+            try:
+                v, end = _pdf_value(buf, 0)
+                if eof or end < len(buf) - 64: return v, buf, end
+            except _Truncated:
+                if eof: raise
+            window *= 8
+        raise ValueError(f"PDF object at {off} too large")
+
+    def _object_at(self, off, num=None):
+        m = re.match(rb"\s*(\d+)\s+(\d+)\s+obj", self._read(off, 64))
+        if not m or (num is not None and int(m[1]) != num): raise ValueError(f"PDF object {num} not at {off}")
+        v, buf, end = self._parse_at(off + m.end())
+        s = re.match(rb"\s*stream(?:\r\n|\n|\r)", buf[end:end + 64]) if isinstance(v, dict) else None
+        return v, (off + m.end() + end + s.end() if s else None)
+
+    def _load_xref(self, off):
+        head = self._read(off, 64)
+        if not head.lstrip().startswith(b"xref"):
+            d, at = self._object_at(off)
+            if not isinstance(d, dict) or d.get("Type") != "XRef" or at is None: raise ValueError("bad PDF xref")
+            self.sections.append((d.get("Index") or [0, d["Size"]], d["W"], self.stream(d, at)))
+            return d
+        i = off + head.index(b"xref") + 4
+        while True:
+            chunk = self._read(i, 64)
+            m = re.match(rb"\s*(\d+)\s+(\d+)[ \t]*(?:\r\n|\r|\n)", chunk)
+            if not m: break
+            self.sections.append((int(m[1]), int(m[2]), i + m.end()))
+            i += m.end() + 20 * int(m[2])                       # entries are exactly 20 bytes
+        m = re.match(rb"\s*trailer", chunk)
+        if not m: raise ValueError("bad PDF xref table")
+        trailer = self._parse_at(i + m.end())[0]
+        if not isinstance(trailer, dict): raise ValueError("bad PDF trailer")
+        return trailer
+
+    def _entry(self, num):
+        # (1, offset, 0) / (2, object stream, index) / None (free or missing)
+        for sec in self.sections:
+            if len(sec) == 3 and isinstance(sec[0], int):
+                first, count, at = sec
+                if first <= num < first + count:
+                    e = self._read(at + 20 * (num - first), 20)
+                    return (1, int(e[:10]), 0) if e[17:18] == b"n" else None
+                continue
+            index, w, data = sec
+            base, step = 0, sum(w)
+            for first, count in zip(index[::2], index[1::2]):
+                if first <= num < first + count:
+                    r, f = (base + num - first) * step, []
+                    for width in w:
+                        f.append(int.from_bytes(data[r:r + width], "big")); r += width
+                    kind = f[0] if w[0] else 1
+                    return (kind, f[1], f[2]) if kind in (1, 2) else None
+                base += count
+        return None
+
+    def obj(self, num):
+        """(value, stream data offset or None) of object num; (None, None) if it doesn't exist."""
+        if num not in self.cache:
+            e = self._entry(num)
+            if e is None: r = (None, None)
+            elif e[0] == 1: r = self._object_at(e[1], num)
+            else: r = (self._in_objstm(e[1], e[2]), None)
+            self.cache[num] = r
+        return self.cache[num]
+
+    def _in_objstm(self, stm, index):
+        if stm not in self.objstms:
+            d, at = self.obj(stm)
+            if not isinstance(d, dict) or at is None: raise ValueError(f"bad PDF object stream {stm}")
+            data = self.stream(d, at) + b"\n"
+            head = data[:d["First"]].split()
+            self.objstms[stm] = (data, d["First"], [int(x) for x in head[1::2]])
+        data, first, offsets = self.objstms[stm]
+        return _pdf_value(data, first + offsets[index])[0]
+
+    def resolve(self, v):
+        for _ in range(8):
+            if not isinstance(v, PdfRef): break
+            v = self.obj(v.num)[0]
+        return v
+
+    def stream(self, d, at, decode=True):
+        n = self.resolve(d.get("Length"))
+        if not isinstance(n, int) or n < 0 or at + n > self.size: raise ValueError("bad PDF stream length")
+        data = self._read(at, n)
+        if not decode: return data
+        filters, parms = self.resolve(d.get("Filter")), self.resolve(d.get("DecodeParms"))
+        filters = filters if isinstance(filters, list) else [filters] if filters else []
+        parms = parms if isinstance(parms, list) else [parms] * len(filters)
+        for name, p in zip(filters, parms):
+            if name != "FlateDecode": raise ValueError(f"unsupported PDF filter {name}")
+            data = zlib.decompress(data)
+            p = self.resolve(p) or {}
+            if p.get("Predictor", 1) >= 10:
+                data = _png_unpredict(data, p.get("Columns", 1), p.get("Colors", 1), p.get("BitsPerComponent", 8))
+            elif p.get("Predictor", 1) != 1: raise ValueError("unsupported PDF predictor")
+        return data
+
+def _pdf_text(v):
+    if isinstance(v, bytes):
+        if v[:2] == b"\xfe\xff": v = v[2:].decode("utf-16-be", "replace")
+        elif v[:3] == b"\xef\xbb\xbf": v = v[3:].decode("utf-8", "replace")
+        else: v = v.decode("latin-1")                          # PDFDocEncoding, near enough
+    return v.replace("\x00", "").strip() if isinstance(v, str) else ""
+
+def _junk_title(t):
+    # What PDF producers put in /Title when nobody set one
+    return t.lower() in ("untitled", "unknown", "title") or bool(re.search(r"\.(docx?|rtf|odt|indd|tex|dvi|qxd|p65|pdf)$", t, re.I))
+
+def _xmp_meta(data):
+    root, meta, isbns = ET.fromstring(data.strip(b"\x00\t\r\n ")), {}, []
+    def items(el):
+        lis = [(li.text or "").strip() for li in el.iter() if _local(li.tag) == "li"]
+        return [x for x in lis if x] or [t for t in [(el.text or "").strip()] if t]
+    for el in root.iter():
+        tag, vals = _local(el.tag), items(el)
+        if el.tag == _DC + "title" and vals: meta.setdefault("title", vals[0])
+        elif el.tag == _DC + "creator" and vals: meta.setdefault("author_list", vals)
+        elif el.tag == _DC + "description" and vals: meta.setdefault("summary", vals[0])
+        elif el.tag == _DC + "language" and vals: meta.setdefault("language", norm_language(vals[0]))
+        elif el.tag == _DC + "subject" and vals: meta.setdefault("tag_list", vals)
+        elif el.tag == _DC + "date" and vals: meta.setdefault("issued_on", norm_date(vals[0]))
+        elif tag.lower() == "isbn": isbns += vals
+        elif tag == "Identifier" or el.tag == _DC + "identifier":
+            # Calibre: <xmp:Identifier><rdf:Bag><rdf:li><xmpidq:Scheme>isbn</..><rdf:value>...
+            for li in el.iter():
+                sub = {_local(c.tag): (c.text or "").strip() for c in li}
+                if sub.get("Scheme", "").lower() == "isbn": isbns.append(sub.get("value"))
+                elif (li.text or "").strip().lower().startswith(("urn:isbn:", "isbn:")): isbns.append(li.text)
+        elif tag == "series" and "series" not in meta:         # calibre:series
+            sub = {_local(c.tag): (c.text or "").strip() for c in el.iter()}
+            name = sub.get("value") or (el.text or "").strip()
+            if name: meta["series"] = [{"title": name, "index": norm_index(sub.get("series_index"))}]
+    isbn = next((norm_isbn(v) for v in isbns if norm_isbn(v)), None)
+    if isbn: meta["isbn"] = isbn
+    return meta
+
+def _pdf_cover(pdf, root):
+    # Largest JPEG (DCTDecode) XObject on the first page: the scanned cover for most book scans
+    node, res = pdf.resolve(root.get("Pages")), None
+    for _ in range(32):                                        # walk the page tree down its first branch
+        if not isinstance(node, dict) or "Kids" not in node: break
+        res = node.get("Resources", res)
+        kids = pdf.resolve(node["Kids"])
+        node = pdf.resolve(kids[0]) if kids else None
+    if not isinstance(node, dict): return None
+    res = pdf.resolve(node.get("Resources", res))
+    xobjs = pdf.resolve(res.get("XObject")) if isinstance(res, dict) else None
+    best = None
+    for ref in (xobjs.values() if isinstance(xobjs, dict) else []):
+        if not isinstance(ref, PdfRef): continue
+        d, at = pdf.obj(ref.num)
+        if not isinstance(d, dict) or at is None or d.get("Subtype") != "Image": continue
+        w, h, n = pdf.resolve(d.get("Width")), pdf.resolve(d.get("Height")), pdf.resolve(d.get("Length"))
+        if pdf.resolve(d.get("Filter")) not in ("DCTDecode", ["DCTDecode"]) \
+                or not all(isinstance(x, int) for x in (w, h, n)) or min(w, h) < PDF_COVER_MIN_PX or n > COVER_MAX:
+            continue
+        if best is None or w * h > best[0]: best = (w * h, d, at)
+    if best is None: return None
+    data = pdf.stream(best[1], best[2], decode=False)
+    return Cover("cover.jpg", data, "image/jpeg") if data.startswith(b"\xff\xd8") else None
+
+def read_pdf_meta(path, cover=True):
+    """
+    Metadata from a PDF by seeking, not parsing: startxref -> xref chain -> the
+    trailer's /Info and the catalog's XMP /Metadata (XMP wins where both have a
+    field). With cover=True the largest JPEG on the first page becomes the cover.
+    Encrypted files give ({}, None).
+    """
+    with open(path, "rb") as f:
+        pdf = PdfReader(f)
+        if "Encrypt" in pdf.trailer: return {}, None
+        root, info = pdf.resolve(pdf.trailer.get("Root")), pdf.resolve(pdf.trailer.get("Info"))
+        if not isinstance(root, dict): raise ValueError("PDF has no catalog")
+        meta = {}
+        if isinstance(info, dict):
+            t = {k: _pdf_text(pdf.resolve(v)) for k, v in info.items()}
+            meta = {"title": None if _junk_title(t.get("Title", "")) else t.get("Title"),
+                    "summary": t.get("Subject"),
+                    "author_list": [a.strip() for a in re.split(r"[;&]", t.get("Author", "")) if a.strip()],
+                    "tag_list": [k.strip() for k in re.split(r"[,;]", t.get("Keywords", "")) if k.strip()]}
+        d, at = pdf.obj(root["Metadata"].num) if isinstance(root.get("Metadata"), PdfRef) else (None, None)
+        if isinstance(d, dict) and at is not None:
+            with contextlib.suppress(*META_ERRORS):             # a broken XMP packet still leaves /Info
+                meta.update({k: v for k, v in _xmp_meta(pdf.stream(d, at)).items() if v})
+        if not meta.get("language"): meta["language"] = norm_language(_pdf_text(pdf.resolve(root.get("Lang"))))
+        return {k: v for k, v in meta.items() if v}, (_pdf_cover(pdf, root) if cover else None)
+
+# --- MOBI / AZW3: PalmDB record list -> MOBI header -> EXTH records ---
+
+# Windows primary language ids, as found in the MOBI header's locale field
+MOBI_LOCALES = {0x01: "ara", 0x04: "zho", 0x05: "ces", 0x06: "dan", 0x07: "deu", 0x08: "ell", 0x09: "eng",
+                0x0A: "spa", 0x0B: "fin", 0x0C: "fra", 0x0D: "heb", 0x0E: "hun", 0x10: "ita", 0x11: "jpn",
+                0x12: "kor", 0x13: "nld", 0x14: "nor", 0x15: "pol", 0x16: "por", 0x19: "rus", 0x1D: "swe", 0x1F: "tur"}
+IMAGE_MAGIC = ((b"\xff\xd8", "image/jpeg", ".jpg"), (b"\x89PNG", "image/png", ".png"), (b"GIF8", "image/gif", ".gif"))
+NO_INDEX = 0xFFFFFFFF
+
+def read_mobi_meta(path, cover=True):
+    """
+    Metadata (and the cover image) of a MOBI/AZW3 from its first record: the MOBI
+    header and EXTH block (100 author, 103 description, 104 ISBN, 105 subject,
+    106 date, 201 cover, 503 title, 524 language). A few small reads, whatever
+    the file size; KF8 and combined files keep their EXTH in the same place.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        def read(off, n):
+            f.seek(off)
+            data = f.read(n)
+            if len(data) < n: raise ValueError("truncated MOBI file")
+            return data
+        head = read(0, 78)
+        if head[60:68] != b"BOOKMOBI": raise ValueError("not a MOBI file")
+        nrec = struct.unpack_from(">H", head, 76)[0]
+        def record(i):
+            # (offset, length); the last record runs to the end of the file
+            if i >= nrec: raise IndexError(f"MOBI record {i} of {nrec}")
+            off, *nxt = struct.unpack(">I4xI" if i + 1 < nrec else ">I", read(78 + 8 * i, 12 if i + 1 < nrec else 4))
+            return off, (nxt[0] if nxt else size) - off
+
+        off, n = record(0)
+        rec0 = read(off, min(n, 1024 * 1024))
+        if rec0[16:20] != b"MOBI": raise ValueError("no MOBI header")
+        hlen, _, enc = struct.unpack_from(">III", rec0, 20)
+        name_off, name_len, locale = struct.unpack_from(">III", rec0, 84)
+        first_image = struct.unpack_from(">I", rec0, 108)[0]
+        exth = {}
+        if hlen >= 0x74 and struct.unpack_from(">I", rec0, 128)[0] & 0x40 and rec0[16 + hlen:20 + hlen] == b"EXTH":
+            i = 28 + hlen
+            for _ in range(struct.unpack_from(">I", rec0, 24 + hlen)[0]):
+                kind, length = struct.unpack_from(">II", rec0, i)
+                if length < 8: break
+                exth.setdefault(kind, []).append(rec0[i + 8:i + length])
+                i += length
+
+        codec = "utf-8" if enc == 65001 else "cp1252"
+        def text(kind):
+            return [t for t in (v.decode(codec, "replace").strip() for v in exth.get(kind, [])) if t]
+        title = (text(503) or [rec0[name_off:name_off + name_len].decode(codec, "replace").strip()])[0] \
+            or head[:32].split(b"\0")[0].decode("latin-1")
+        meta = {"title": title,
+                "summary": (text(103) or [None])[0],
+                "author_list": [a.strip() for v in text(100) for a in re.split(r"[;&]", v) if a.strip()],
+                "tag_list": text(105),
+                "isbn": next((norm_isbn(v) for v in text(104) if norm_isbn(v)), None),
+                "issued_on": norm_date((text(106) or [None])[0]),
+                "language": norm_language((text(524) or [None])[0]) or MOBI_LOCALES.get(locale & 0xFF)}
+        meta = {k: v for k, v in meta.items() if v}
+        if not cover or first_image == NO_INDEX: return meta, None
+
+        # 201 is the cover's offset from the first image record; 202 (thumbnail) as a fallback
+        for kind in (201, 202):
+            raw = exth.get(kind, [b""])[0]
+            rel = struct.unpack(">I", raw[:4])[0] if len(raw) >= 4 else NO_INDEX
+            if rel == NO_INDEX or first_image + rel >= nrec: continue
+            off, n = record(first_image + rel)
+            if n > COVER_MAX: continue
+            data = read(off, n)
+            for magic, mimetype, ext in IMAGE_MAGIC:
+                if data.startswith(magic): return meta, Cover("cover" + ext, data, mimetype)
+    return meta, None
+
+EXTRACTORS = {".epub": read_epub_meta, ".pdf": read_pdf_meta, ".mobi": read_mobi_meta, ".azw3": read_mobi_meta}
+
+def extract_metadata(path, cover=True):
+    """(meta, Cover or None) embedded in a book file; ({}, None) for formats without an extractor."""
+    fn = EXTRACTORS.get(Path(path).suffix.lower())
+    return fn(path, cover) if fn else ({}, None)
+
+CALIBRE_FORMATS = ("EPUB", "AZW3", "MOBI", "PDF")
+
+def _calibre_date(value):
+    # Calibre stores UTC timestamps and shows (and the plugin sends) the local date; 0101-01-01 means unset
+    try:
+        d = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if d.year < 1000: return None
+    return (d.astimezone() if d.tzinfo else d).date().isoformat()
+
+def iter_calibre_library(library, formats=CALIBRE_FORMATS, verbose=False):
+    """
+    (path, meta, cover_path) for every book in a Calibre library, read from its
+    metadata.db opened read-only (Calibre needn't be running, but may be).
+    One pass in book id order: the books query plus one query per link table, each
+    sorted by book along its index and merged as they stream, so memory stays flat
+    however big the library. meta holds what the Calibre plugin sends: authors and
+    tags in Calibre's order, the first language, the isbn identifier, the local
+    publication date and series_index as stored. The file is the book's first
+    format in `formats`; books without any of them are skipped.
+    """
+    db = Path(library).expanduser().resolve()
+    if db.is_dir(): db = db / "metadata.db"
+    if not db.is_file(): raise FileNotFoundError(f"No Calibre library at {library} (metadata.db not found)")
+    con = sqlite3.connect(db.as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+    try:
+        def side(sql):
+            # rows (book, ...) sorted by book -> lookup for the current book, advanced in step with the books query
+            groups = itertools.groupby(con.execute(sql), key=lambda r: r[0])
+            cur = next(groups, None)
+            def rows(book):
+                nonlocal cur
+                while cur is not None and cur[0] < book: cur = next(groups, None)
+                return [r[1:] for r in cur[1]] if cur is not None and cur[0] == book else []
+            return rows
+        authors = side("SELECT l.book, a.name FROM books_authors_link l JOIN authors a ON a.id = l.author ORDER BY l.book, l.id")
+        tags = side("SELECT l.book, t.name FROM books_tags_link l JOIN tags t ON t.id = l.tag ORDER BY l.book, l.id")
+        langs = side("SELECT l.book, g.lang_code FROM books_languages_link l JOIN languages g ON g.id = l.lang_code "
+                     "ORDER BY l.book, l.item_order")
+        isbns = side("SELECT book, val FROM identifiers WHERE type = 'isbn' ORDER BY book")
+        files = side("SELECT book, format, name FROM data ORDER BY book")
+        rank = {f.upper(): i for i, f in enumerate(formats)}
+        books = con.execute("SELECT b.id, b.title, b.path, b.has_cover, b.pubdate, b.series_index, s.name, c.text "
+                            "FROM books b LEFT JOIN books_series_link bs ON bs.book = b.id "
+                            "LEFT JOIN series s ON s.id = bs.series LEFT JOIN comments c ON c.book = b.id ORDER BY b.id")
+        for book, title, rel, has_cover, pubdate, series_index, series, comments in books:
+            found = sorted((rank[fmt.upper()], fmt, name) for fmt, name in files(book) if fmt.upper() in rank)
+            if not found:
+                if verbose: print(f"    calibre book {book} ({title}): no {'/'.join(formats)} file, skipped", file=sys.stderr)
+                continue
+            _, fmt, name = found[0]
+            folder = db.parent / rel
+            meta = {"title": title, "summary": comments,
+                    "language": next((l for l, in langs(book)), None),
+                    "isbn": next((i for i, in isbns(book)), None),
+                    "issued_on": _calibre_date(pubdate),
+                    "author_list": [a.replace("|", ",") for a, in authors(book)],   # Calibre stores ',' as '|'
+                    "tag_list": [t for t, in tags(book)],
+                    "series": [{"title": series, "index": norm_index(series_index)}] if series else []}
+            yield (folder / f"{name}.{fmt.lower()}", {k: v for k, v in meta.items() if v},
+                   str(folder / "cover.jpg") if has_cover else None)
+    finally:
+        con.close()
+
+def book_meta(args, path: Path, cover=None, entry=None):
+    """
+    meta dict and cover for one book: CLI flags over the metadata embedded in the
+    file (unless --no-embedded-meta). A CLI --cover wins over the embedded cover;
+    PDFs only get one from their first page with --pdf-cover. `entry` is the
+    book's BookEntry from a batch source: its manifest fields override the CLI
+    flags (tags add to them), and Calibre metadata replaces the file's own.
+    A file whose metadata can't be read just gets the CLI/file-name defaults.
+    """
+    if entry is not None and entry.fields:
+        f = entry.fields
+        args = argparse.Namespace(**{**vars(args), **f, "tags": (args.tags or []) + f.get("tags", [])})
+        cover = f.get("cover") or cover
+    embedded, found = {}, None
+    if entry is not None and entry.meta is not None:
+        embedded, found = entry.meta, entry.cover
+    elif not args.no_embedded_meta:
+        want_cover = cover is None and (args.pdf_cover or path.suffix.lower() != ".pdf")
+        try:
+            embedded, found = extract_metadata(path, want_cover)
+        except META_ERRORS as e:
+            if args.verbose: print(f"    {path.name}: no embedded metadata ({e})", file=sys.stderr)
+    return build_meta(args, path, embedded), cover or found
+
+def build_meta(args, path: Path, embedded=None):
+    emb = embedded or {}
+    title = args.title or emb.get("title") or path.stem
+    cli_tags = [t.strip() for tag in args.tags for t in tag.split(",")] if args.tags else []
     meta = {
         "title": title,
-        "summary": args.summary or None,
-        "language": args.lang or None,
-        "isbn": args.isbn or None,
-        "issued_on": args.issued_on or None,
-        "author_list": args.authors or [],
-        "tag_list": (
-           [t.strip() for tag in args.tags for t in tag.split(",")]
-            if args.tags else []
-        ),
-        "series": []
+        "summary": args.summary or emb.get("summary"),
+        "language": args.lang or emb.get("language"),
+        "isbn": args.isbn or emb.get("isbn"),
+        "issued_on": args.issued_on or emb.get("issued_on"),
+        "author_list": args.authors or emb.get("author_list") or [],
+        "tag_list": list(dict.fromkeys(emb.get("tag_list", []) + cli_tags)),
+        "series": [] if args.series else list(emb.get("series", []))
     }
     if args.series:
         for item in args.series:
-            if ":" in item:
+            # Indexes are normalized like embedded ones, so the digest matches the same book's
+            if isinstance(item, dict):      # {"title", "index"} from a JSONL manifest
+                meta["series"].append({"title": item["title"], "index": norm_index(item.get("index"))})
+            elif ":" in item:
                 t, idx = item.split(":", 1)
-                try:
-                    idxv = float(idx) if "." in idx else int(idx)
-                except:
-                    idxv = idx
-                meta["series"].append({"title": t, "index": idxv})
+                idxv = norm_index(idx)
+                meta["series"].append({"title": t, "index": idx if idxv is None else idxv})
             else:
                 meta["series"].append({"title": item, "index": None})
 
     # Only send bookshelves if user provided any
     meta["bookshelves"] = (args.shelves or None)
-    cover_path = args.cover or None
+    return meta
+
+class AdaptiveLimit:
+    """
+    Concurrency limit that tunes itself (AIMD). slot(weight) is a context manager
+    for one call, usable from threads (`with`) and asyncio tasks (`async with`);
+    waiters get slots in FIFO order. Each call's latency divided by its weight (MB,
+    at least 1, for an S3 upload, so big books don't look like a slow server) is collected in
+    windows of max(WINDOW, limit) calls. A window whose p95 stays within RISE x the
+    best recent p95 and that kept every slot busy raises the limit (doubling until
+    the first cut, then +1); a higher p95 cuts it to 0.8x, and a 429/503 inside a
+    slot to 0.7x (as in CUBIC), at most once per window. The limit stays within [1, maximum];
+    on_change(name, old, new, reason) hears about every change.
+    """
+    WINDOW = 10
+    RISE = 2.0
+    THROTTLE_STATUS = {429, 503}
+
+    def __init__(self, maximum, initial=2, name="", on_change=None):
+        self.maximum, self.name, self.on_change = maximum, name, on_change
+        self.limit = float(max(1, min(initial, maximum)))
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.waiters = deque()
+        self.slow_start = True
+        self.best = None
+        self._new_window()
+
+    def _new_window(self):
+        self.samples, self.calls, self.saturated, self.cut = [], 0, False, False
+
+    def slot(self, weight=1.0):
+        return _Slot(self, weight)
+
+    # --- slots ---
+    def _try_acquire(self, waiter=None):
+        with self.lock:
+            if not self.waiters and self.inflight < int(self.limit):
+                self.inflight += 1
+                self.saturated |= self.inflight >= int(self.limit)
+                return True
+            self.saturated = True
+            if waiter is not None: self.waiters.append(waiter)
+            return False
+
+    def acquire(self):
+        ev = threading.Event()
+        if not self._try_acquire(ev): ev.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        w = (loop, loop.create_future())
+        if self._try_acquire(w): return
+        try:
+            await w[1]
+        except asyncio.CancelledError:
+            with self.lock:
+                if w in self.waiters: self.waiters.remove(w)
+                elif w[1].done() and not w[1].cancelled(): self._release()
+            raise
+
+    def _grant(self):
+        # lock held: hand free slots to the oldest waiters
+        while self.waiters and self.inflight < int(self.limit):
+            w = self.waiters.popleft()
+            self.inflight += 1
+            if isinstance(w, threading.Event): w.set()
+            else: w[0].call_soon_threadsafe(self._resolve, w[1])
+
+    def _resolve(self, fut):
+        if fut.done():       # cancelled meanwhile: the slot goes back
+            with self.lock: self._release()
+        else:
+            fut.set_result(None)
+
+    def _release(self):
+        self.inflight -= 1
+        self._grant()
+
+    def release(self, latency=None, throttled=False):
+        with self.lock:
+            self._release()
+            change = self._observe(latency, throttled)
+        if change and self.on_change: self.on_change(self.name, *change)
+
+    # --- control ---
+    def _set(self, limit, reason):
+        old = int(self.limit)
+        self.limit = max(1.0, min(float(self.maximum), limit))
+        self._grant()
+        return (old, int(self.limit), reason) if int(self.limit) != old else None
+
+    def _observe(self, latency, throttled):
+        if throttled:
+            self.calls += 1
+            if not self.cut:
+                self.slow_start, cut = False, self._set(self.limit * 0.7, "throttled")
+                self._new_window()
+                self.cut = True
+                return cut
+        elif latency is not None:
+            self.calls += 1
+            self.samples.append(latency)
+        if self.calls < max(self.WINDOW, int(self.limit)): return None
+        change = None
+        if self.samples and not self.cut:
+            ds = sorted(self.samples)
+            p95 = ds[min(len(ds) - 1, int(0.95 * len(ds)))]
+            self.best = p95 if self.best is None else min(p95, self.best * 1.05)   # best drifts up slowly
+            if p95 > self.best * self.RISE:
+                self.slow_start, change = False, self._set(self.limit * 0.8, "latency")
+            elif self.saturated:
+                change = self._set(self.limit * 2 if self.slow_start else self.limit + 1, "increase")
+        self._new_window()
+        return change
+
+class _Slot:
+    def __init__(self, limit, weight):
+        self.limit, self.weight = limit, max(weight, 1e-3)
+
+    def _exit(self, exc):
+        throttled = isinstance(exc, HTTPStatusError) and exc.status in AdaptiveLimit.THROTTLE_STATUS
+        latency = (time.perf_counter() - self.t) / self.weight if exc is None else None
+        self.limit.release(latency, throttled)
+
+    def __enter__(self):
+        self.limit.acquire()
+        self.t = time.perf_counter()
+
+    def __exit__(self, et, exc, tb):
+        self._exit(exc)
 
-    file_digest = sha256_file(path)
-    if args.verbose:
-        print(f">>> FILE: {path.name} size={path.stat().st_size} sha256={file_digest}")
+    async def __aenter__(self):
+        await self.limit.aacquire()
+        self.t = time.perf_counter()
 
-    init = do_init(args.api_base, auth, path.name, file_digest, verbose=args.verbose)
-    s3_url   = init["url"]
-    s3_params= init["params"]
-    s3_key   = s3_params.get("key")
-    if args.verbose: print(f"    S3 key: {s3_key}")
+    async def __aexit__(self, et, exc, tb):
+        self._exit(exc)
 
-    do_s3_post(s3_url, s3_params, path, verbose=args.verbose)
+class PhaseLimits:
+    """
+    Caps on in-flight API calls (init/finalize) and S3 uploads, shared by all batch
+    workers. With `adaptive`, api/s3 are upper bounds for AdaptiveLimits (usable from
+    asyncio as well); otherwise they are fixed semaphores.
+    """
+    def __init__(self, api=None, s3=None, adaptive=False, on_change=None):
+        self.adaptive = adaptive
+        if adaptive:
+            self.api = AdaptiveLimit(api, name="api", on_change=on_change)
+            self.s3  = AdaptiveLimit(s3,  name="s3",  on_change=on_change)
+        else:
+            self.api = threading.BoundedSemaphore(api) if api else contextlib.nullcontext()
+            self.s3  = threading.BoundedSemaphore(s3)  if s3  else contextlib.nullcontext()
+
+    def api_slot(self):
+        return self.api.slot() if self.adaptive else self.api
+
+    def s3_slot(self, nbytes):
+        return self.s3.slot(max(nbytes / 1e6, 1.0)) if self.adaptive else self.s3
+
+    def current(self):
+        return {"api": int(self.api.limit), "s3": int(self.s3.limit)} if self.adaptive else None
 
-    meta_digest = compute_calibre_metadata_digest(meta, cover_path)
-    if args.verbose: print(f"    metadata digest: {meta_digest}")
+NO_LIMITS = PhaseLimits()
 
-    r = do_finalize(args.api_base, auth, s3_key, file_digest, meta, meta_digest, cover_path, verbose=args.verbose)
+PHASES = ("hash", "meta", "init", "s3", "finalize")
+PROM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+@contextlib.contextmanager
+def timed(timings, phase):
+    """Add the time spent in the block to timings[phase] (no-op when timings is None)."""
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None: timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - t
+
+def phase_ms(timings):
+    return {k: round(v * 1000, 1) for k, v in timings.items()}
+
+class Metrics:
+    """
+    Run metrics built from the per-book result dicts: phase times ("ms"), bytes,
+    retries and actions, plus connection reuse and gauges at the end. Always kept
+    in memory for the summary's "phases" block; optionally also sent to
+      jsonl      - JSON-lines events: "book" per file, "summary" at the end (path, or '-' for stderr)
+      prometheus - text-format file for node_exporter's textfile collector, rewritten
+                   atomically every PROM_INTERVAL seconds and at the end
+      statsd     - "host:port"; per-book timers and counters over UDP
+    """
+    PROM_INTERVAL = 10.0
+
+    def __init__(self, jsonl=None, prometheus=None, statsd=None, prefix="bf_uploader"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.durations = {p: [] for p in PHASES}
+        self.hist = {}           # phase -> [bucket counts..., sum]
+        self.counters = {}       # (name, labels) -> value
+        self.gauges = {}
+        self.jsonl = (sys.stderr if jsonl == "-" else open(jsonl, "a", buffering=1)) if jsonl else None
+        self.prometheus, self.prom_at = prometheus, 0.0
+        self.statsd = None
+        if statsd:
+            host, _, port = statsd.rpartition(":")
+            family, _, _, _, addr = socket.getaddrinfo(host or "127.0.0.1", int(port), type=socket.SOCK_DGRAM)[0]
+            self.statsd, self.statsd_addr = socket.socket(family, socket.SOCK_DGRAM), addr
+
+    def _count(self, name, labels=(), n=1):
+        self.counters[name, labels] = self.counters.get((name, labels), 0) + n
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[name, tuple(sorted(labels.items()))] = value
+
+    def limit_changed(self, phase, old, new, reason):
+        """AdaptiveLimit on_change hook: gauge plus a "limit" event."""
+        self.gauge("concurrency_limit", new, phase=phase)
+        if self.jsonl:
+            with self.lock:
+                self.jsonl.write(json.dumps({"ts": round(time.time(), 3), "event": "limit", "phase": phase,
+                                             "old": old, "new": new, "reason": reason}) + "\n")
+
+    def book(self, path, res):
+        """Record one finished book (its result dict as returned by upload_book)."""
+        result = res.get("action", "failed") if res["ok"] else "failed"
+        sent = 0
+        if res.get("action") == "uploaded":
+            with contextlib.suppress(OSError): sent = os.stat(path).st_size
+        with self.lock:
+            for phase, ms in res.get("ms", {}).items():
+                secs = ms / 1000
+                self.durations.setdefault(phase, []).append(secs)
+                h = self.hist.setdefault(phase, [0] * (len(PROM_BUCKETS) + 2))
+                h[bisect.bisect_left(PROM_BUCKETS, secs)] += 1
+                h[-1] += secs
+            self._count("books_total", (("result", result),))
+            self._count("bytes_read_total", (), res.get("bytes_read", 0))
+            self._count("bytes_uploaded_total", (), sent)
+            for phase, n in res.get("retries", {}).items():
+                self._count("retries_total", (("phase", phase),), n)
+            if self.jsonl:
+                self.jsonl.write(json.dumps({"ts": round(time.time(), 3), "event": "book", "file": str(path), **res}) + "\n")
+            due = self.prometheus and time.monotonic() - self.prom_at >= self.PROM_INTERVAL
+        if self.statsd:
+            lines = [f"{self.prefix}.phase.{p}:{ms}|ms" for p, ms in res.get("ms", {}).items()]
+            lines += [f"{self.prefix}.books.{result}:1|c", f"{self.prefix}.bytes_read:{res.get('bytes_read', 0)}|c",
+                      f"{self.prefix}.bytes_uploaded:{sent}|c"]
+            lines += [f"{self.prefix}.retries.{p}:{n}|c" for p, n in res.get("retries", {}).items()]
+            self._statsd(lines)
+        if due: self.write_prometheus()
+
+    def _statsd(self, lines):
+        with contextlib.suppress(OSError):
+            self.statsd.sendto("\n".join(lines).encode(), self.statsd_addr)
+
+    def phase_summary(self):
+        """{phase: {"n", "total_s", "p50_ms", "p95_ms"}} over all recorded books."""
+        out = {}
+        with self.lock:
+            for phase, ds in self.durations.items():
+                if not ds: continue
+                ds = sorted(ds)
+                q = lambda f: round(ds[min(len(ds) - 1, int(f * len(ds)))] * 1000, 1)
+                out[phase] = {"n": len(ds), "total_s": round(sum(ds), 3), "p50_ms": q(0.5), "p95_ms": q(0.95)}
+        return out
+
+    def write_prometheus(self):
+        pre = self.prefix
+        with self.lock:
+            self.prom_at = time.monotonic()
+            out = [f"# HELP {pre}_phase_seconds Time per book spent in each upload phase, retries included.",
+                   f"# TYPE {pre}_phase_seconds histogram"]
+            for phase, h in self.hist.items():
+                acc = 0
+                for le, n in zip((*PROM_BUCKETS, "+Inf"), h[:-1]):
+                    acc += n
+                    out.append(f'{pre}_phase_seconds_bucket{{phase="{phase}",le="{le}"}} {acc}')
+                out.append(f'{pre}_phase_seconds_sum{{phase="{phase}"}} {h[-1]:.6f}')
+                out.append(f'{pre}_phase_seconds_count{{phase="{phase}"}} {acc}')
+            for kind, items in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({n for n, _ in items}):
+                    out.append(f"# TYPE {pre}_{name} {kind}")
+                    for (n, labels), v in items.items():
+                        if n != name: continue
+                        lbl = ",".join(f'{k}="{v2}"' for k, v2 in labels)
+                        out.append(f"{pre}_{name}{{{lbl}}} {v}" if lbl else f"{pre}_{name} {v}")
+            out.append(f"# TYPE {pre}_last_update_timestamp_seconds gauge")
+            out.append(f"{pre}_last_update_timestamp_seconds {time.time():.3f}")
+        tmp = f"{self.prometheus}.tmp"
+        with open(tmp, "w") as f:
+            f.write("\n".join(out) + "\n")
+        os.replace(tmp, self.prometheus)
+
+    def finish(self, summary):
+        """End of run: connection stats become gauges, then every sink gets the final state."""
+        for pool, st in summary.get("connections", {}).items():
+            for kind, v in st.items(): self.gauge("connections", v, pool=pool, kind=kind)
+        if self.jsonl:
+            self.jsonl.write(json.dumps({"ts": round(time.time(), 3), "event": "summary", **summary}) + "\n")
+            if self.jsonl is not sys.stderr: self.jsonl.close()
+        if self.prometheus: self.write_prometheus()
+        if self.statsd:
+            self._statsd([f"{self.prefix}.{name}.{'.'.join(str(v) for _, v in labels)}:{v}|g"
+                          for (name, labels), v in self.gauges.items()])
+            self.statsd.close()
+
+def make_metrics(args):
+    return Metrics(args.metrics, args.prometheus, args.statsd)
+
+def upload_book(client: BFClient, path: Path, meta: dict, cover_path=None, verbose=False, limits=NO_LIMITS,
+                prepared=None, ledger=None, force=False, metadata_only=False, retry=NO_RETRY, journal=None,
+                chunks=DEFAULT_CHUNKS):
+    """
+    Run one book through init -> S3 POST -> finalize.
+    `prepared` is the book's Prepared from prepare_book (hashed here if omitted). If it
+    carries a spool, the upload is served from it (and it is closed here).
+    With a `ledger`, books whose file and metadata digests were already uploaded are
+    skipped ("action": "skipped"), books whose metadata alone changed are only
+    re-finalized ("action": "metadata"), and successful uploads are recorded
+    (unless `force`, the ledger is consulted first).
+    With `metadata_only` the file is never sent: only books the ledger (or the
+    journal) shows in S3 are finalized; /uploads/init doesn't say whether BookFusion
+    has a file, so any other book fails with "not uploaded yet".
+    `retry` is applied per phase: a failed S3 POST is re-sent with the same presigned
+    params while they are valid, and /uploads/init is only repeated once they expire.
+    With a `journal`, each completed phase is logged and a book the journal already
+    carried past init/S3/finalize resumes from there instead of starting over.
+    `chunks` picks the read size for the S3 body.
+    Returns {"ok": True, "action", "bookfusion_id", "key", "bytes_read", "ms"[, "retries"]} or, when finalize is rejected,
+    {"ok": False, "action", "key", "status", "error", "bytes_read", "ms"[, "retries"]}, where "ms" holds the time
+    spent per phase (hash, meta, init, s3, finalize; retries and backoff included). Init/S3 failures raise RuntimeError.
+    """
+    prepared = prepared or prepare_book(path, chunks=chunks)
+    tries, timings = {}, {"hash": prepared.hash_secs}
+    with contextlib.closing(prepared.spool) if prepared.spool is not None else contextlib.nullcontext():
+        res = _upload_book(client, path, meta, cover_path, verbose, limits, ledger, force, metadata_only,
+                           retry, tries, timings, journal, chunks, *prepared[:3])
+    res["ms"] = phase_ms(timings)
+    if tries: res["retries"] = tries
+    return res
+
+def _upload_book(client, path, meta, cover_path, verbose, limits, ledger, force, metadata_only, retry, tries, timings,
+                 journal, chunks, file_digest, spool, bytes_read):
+    st = path.stat()
+    size = st.st_size
+    if verbose:
+        print(f">>> FILE: {path.name} size={size} sha256={file_digest}")
+
+    with timed(timings, "meta"):
+        cover_path = load_cover(cover_path)   # read once, shared by the digest and finalize
+        meta_digest = compute_calibre_metadata_digest(meta, cover_path)
+    if verbose: print(f"    metadata digest: {meta_digest}")
+
+    known, skip = ledger_check(ledger, file_digest, meta_digest, force)
+    if skip:
+        if verbose: print(f"    already uploaded as {known.bookfusion_id}, skipping")
+        return {"ok": True, "action": "skipped", "bookfusion_id": known.bookfusion_id,
+                "key": known.s3_key, "bytes_read": bytes_read}
+    if known:
+        if verbose: print(f"    metadata changed, re-finalizing {known.s3_key}")
+        return finalize_book(client, path, known.s3_key, file_digest, meta, meta_digest, cover_path,
+                             verbose, limits, ledger, "metadata", bytes_read, retry, tries, journal, timings)
+
+    rec = journal.get(path, st) if journal is not None and not force else None
+    if rec and rec.get("digest") != file_digest: rec = None
+    if rec and rec["phase"] == "finalized" and rec["meta_digest"] == meta_digest:
+        if verbose: print(f"    journal: finalized as {rec['bookfusion_id']}, skipping")
+        return {"ok": True, "action": "skipped", "bookfusion_id": rec["bookfusion_id"],
+                "key": rec["key"], "bytes_read": bytes_read}
+    if rec and rec["phase"] in ("uploaded", "finalized"):
+        if verbose: print(f"    journal: already in S3 as {rec['key']}, resuming at finalize")
+        return finalize_book(client, path, rec["key"], file_digest, meta, meta_digest, cover_path, verbose, limits,
+                             ledger, "metadata" if metadata_only else "uploaded", bytes_read, retry, tries, journal, timings)
+    if metadata_only:
+        # Nothing shows the file in S3; finalizing a fresh init key would point at an empty object
+        if verbose: print("    metadata only, but the file was never uploaded")
+        return {"ok": False, "action": "metadata", "key": None, "error": "not uploaded yet", "bytes_read": bytes_read}
+
+    def init_phase():
+        client.rates.api.take()     # before the slot: a rate wait isn't API latency
+        with limits.api_slot():
+            init = client.init(path.name, file_digest, verbose=verbose)
+        if journal is not None:
+            journal.log(path, st, "inited", digest=file_digest, init=init)
+        return init
+
+    if rec and rec["phase"] == "inited":
+        if verbose: print("    journal: resuming with presigned params from the previous run")
+        init = rec["init"]     # checked for expiry before the S3 POST
+    else:
+        with timed(timings, "init"):
+            init = retry.call("init", init_phase, tries, verbose=verbose)
+    if verbose: print(f"    S3 key: {init['params'].get('key')}")
+
+    stale = False    # S3 refused the presigned params as expired
+    def s3_phase():
+        nonlocal init, stale, bytes_read
+        if presign_stale(init, stale):
+            if verbose: print("    presigned params expired, re-initializing")
+            init, stale = retry.call("init", init_phase, tries, verbose=verbose), False
+        if spool is None: bytes_read += size
+        try:
+            with limits.s3_slot(size):
+                return client.s3_post(init["url"], init["params"], path, verbose=verbose, source=spool,
+                                      chunk=chunks.upload(path))
+        except HTTPStatusError as e:
+            stale = refused_as_expired(e)
+            raise
+
+    with timed(timings, "s3"):
+        retry.call("s3", s3_phase, tries, retryable=lambda e: stale or retry.retryable(e), verbose=verbose)
+    s3_key = init["params"].get("key")
+    if journal is not None:
+        journal.log(path, st, "uploaded", digest=file_digest, key=s3_key)
+
+    return finalize_book(client, path, s3_key, file_digest, meta, meta_digest, cover_path,
+                         verbose, limits, ledger, "uploaded", bytes_read, retry, tries, journal, timings)
+
+def finalize_book(client, path, s3_key, file_digest, meta, meta_digest, cover_path, verbose, limits, ledger, action,
+                  bytes_read=0, retry=NO_RETRY, tries=None, journal=None, timings=None):
+    """/uploads/finalize for an object already in S3; records success in the ledger/journal and returns the result dict."""
+    def finalize_phase():
+        client.rates.api.take()
+        with limits.api_slot():
+            r = client.finalize(s3_key, file_digest, meta, meta_digest, cover_path, verbose=verbose)
+            if r.status_code in retry.RETRY_STATUS:
+                raise HTTPStatusError(f"finalize failed: HTTP {r.status_code} - {r.text[:500]}", r)
+        return r
+
+    try:
+        with timed(timings, "finalize"):
+            r = retry.call("finalize", finalize_phase, tries, verbose=verbose)
+    except HTTPStatusError as e:
+        r = e.response    # retries used up: report it like any other rejected finalize
+    return finalize_result(r, path, s3_key, file_digest, meta_digest, ledger, action, bytes_read, journal)
+
+def finalize_result(r, path, s3_key, file_digest, meta_digest, ledger, action, bytes_read, journal=None):
+    """Turn a finalize response into the book's result dict, recording success in the ledger/journal."""
     try:
         js = r.json()
     except Exception:
         js = None
 
     if r.status_code in (200,201) and js and "id" in js:
-        print(json.dumps({"ok": True, "bookfusion_id": js["id"], "key": s3_key}, indent=2))
+        if ledger is not None:
+            ledger.record(path, file_digest, meta_digest, s3_key, js["id"])
+        if journal is not None:
+            journal.log(path, os.stat(path), "finalized", digest=file_digest, key=s3_key,
+                        meta_digest=meta_digest, bookfusion_id=js["id"])
+        return {"ok": True, "action": action, "bookfusion_id": js["id"], "key": s3_key, "bytes_read": bytes_read}
+    return {"ok": False, "action": action, "key": s3_key, "status": r.status_code,
+            "error": js if js is not None else r.text[:1000], "bytes_read": bytes_read}
+
+def run_ordered(fn, items, jobs, ordered=True):
+    """
+    Map fn over items on `jobs` threads, yielding (item, result) in input order
+    (or, with ordered=False, as each one finishes). Items are pulled lazily and at
+    most 2*jobs run or wait in the pool at once; a slow item only holds back
+    reporting, never the start of later items. fn must not raise.
+    """
+    it = iter(items)
+    inflight, finished, nxt, idx = {}, {}, 0, 0
+    with ThreadPoolExecutor(max_workers=jobs) as ex:
+        def fill():
+            nonlocal idx
+            while len(inflight) < 2 * jobs:
+                try: item = next(it)
+                except StopIteration: return
+                inflight[ex.submit(fn, item)] = (idx, item)
+                idx += 1
+        fill()
+        while inflight:
+            done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+            for f in done:
+                i, item = inflight.pop(f)
+                finished[i if ordered else nxt + len(finished)] = (item, f.result())
+            while nxt in finished:
+                yield finished.pop(nxt)
+                nxt += 1
+            fill()
+
+_DONE = object()
+
+def merged(iterables, depth):
+    """
+    Drain each iterable on its own thread and yield their items as they arrive,
+    through a queue of at most `depth` entries. Producers keep working while the
+    consumer is busy and only stall when the queue is full; an exception in any of
+    them is re-raised in the consumer.
+    """
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    def put(x):
+        # Gives up once the consumer has stopped reading, so no producer blocks for good
+        while not stop.is_set():
+            try:
+                q.put(x, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def produce(it):
+        try:
+            for out in it:
+                if not put(out): return
+        except BaseException as e:
+            put(e)
+        finally:
+            put(_DONE)
+    for it in iterables:
+        threading.Thread(target=produce, args=(it,), name="bf-stage", daemon=True).start()
+    try:
+        running = len(iterables)
+        while running:
+            out = q.get()
+            if out is _DONE:
+                running -= 1
+                continue
+            if isinstance(out, BaseException): raise out
+            yield out
+    finally:
+        stop.set()
+
+def staged(fn, items, workers, depth):
+    """
+    Pipeline stage: run fn over items on its own pool of `workers` threads and hand
+    (item, result) to the consumer in input order through a queue of at most
+    `depth` entries (see merged). fn must not raise.
+    """
+    return merged([run_ordered(fn, items, workers)], depth)
+
+# One book of a batch and its BookEntry from a manifest record or Calibre library (if any)
+BatchItem = namedtuple("BatchItem", "path entry", defaults=(None,))
+
+def size_lanes(items, threshold):
+    """
+    Split BatchItems into (large, small) at `threshold` bytes, each sorted largest
+    first (longest-processing-time first; ties keep input order). Files that can't
+    be stat'ed count as small and fail later with the usual error.
+    """
+    sized = []
+    for item in items:
+        try:
+            size = item.path.stat().st_size
+        except OSError:
+            size = 0
+        sized.append((size, item))
+    sized.sort(key=lambda t: -t[0])
+    return [b for n, b in sized if n >= threshold], [b for n, b in sized if n < threshold]
+
+def make_hasher(args):
+    """
+    (hasher(path, chunk), process pool or None) per --hash-method/--hash-procs,
+    hashing at most --hash-workers books at once in either runner.
+    """
+    if args.hash_procs:
+        procs = ProcessPoolExecutor(args.hash_workers, mp_context=multiprocessing.get_context("spawn"))
+        return lambda p, chunk: procs.submit(sha256_file, str(p), chunk, args.hash_method).result(), procs
+    gate = threading.BoundedSemaphore(args.hash_workers)
+    def hasher(p, chunk):
+        with gate:
+            return sha256_file(p, chunk, args.hash_method)
+    return hasher, None
+
+def make_retry(args):
+    return RetryPolicy(args.retries, args.retry_delay, args.retry_max_delay, args.retry_budget)
+
+def make_rates(args):
+    """RateLimits from --s3-bandwidth/--api-rate, plus a RateControl watching --rate-file (or None)."""
+    rates = RateLimits((args.s3_bandwidth or 0) * 1e6, args.api_rate)
+    return rates, RateControl(rates, args.rate_file) if args.rate_file else None
+
+def make_limits(args, metrics=None):
+    limits = PhaseLimits(api=args.api_concurrency or args.jobs, s3=args.s3_concurrency or args.jobs,
+                         adaptive=args.adaptive, on_change=metrics.limit_changed if metrics else None)
+    if limits.adaptive and metrics:
+        for phase, n in limits.current().items(): metrics.gauge("concurrency_limit", n, phase=phase)
+    return limits
+
+def make_client(args, auth, rates=NO_RATES):
+    conc = max(args.jobs, args.api_concurrency or 0, args.s3_concurrency or 0)
+    return BFClient(args.api_base, auth, pool_size=args.pool_size or max(10, conc), rates=rates,
+                    timeout=(args.connect_timeout, args.read_timeout))
+
+def open_state(args, api_key):
+    """
+    (DigestCache, UploadLedger, StateDB) per the CLI flags; any of them None if
+    disabled or unavailable. The ledger is scoped to --api-base and the API key.
+    """
+    if args.no_digest_cache and args.no_ledger: return None, None, None
+    try:
+        state = StateDB(args.state_db)
+        return (None if args.no_digest_cache else DigestCache(state),
+                None if args.no_ledger else UploadLedger(state, account_key(args.api_base, api_key)), state)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Local state disabled ({args.state_db}: {e})", file=sys.stderr)
+        return None, None, None
+
+def run_batch(args, client: BFClient, cache=None, ledger=None, journal=None, chunks=DEFAULT_CHUNKS, metrics=None):
+    """Upload every book from the CLI inputs/manifest in this process. One JSON line per file, then a summary."""
+    cover_path = load_cover(args.cover)   # one read for the whole batch
+    retry = make_retry(args)
+    total = ok = bytes_read = 0
+    actions = {}
+    t0 = time.monotonic()
+    metrics = metrics or Metrics()
+    limits = make_limits(args, metrics)
+
+    hasher, procs = make_hasher(args)
+
+    # Every job hashes ahead of its upload, so cap what their spools keep in RAM
+    budget = SpoolBudget(args.spool_budget * 1024 * 1024) if args.single_pass else None
+
+    def prepare(item):
+        # Hashing stage; errors are handed on to the upload stage
+        path = item.path
+        try:
+            if not path.is_file(): raise FileNotFoundError(f"File not found: {path}")
+            prepared = prepare_book(path, cache, args.rehash, args.single_pass, args.spool_max * 1024 * 1024,
+                                    journal, hasher, chunks, budget)
+            return prepared, book_meta(args, path, cover_path, item.entry)
+        except Exception as e:
+            return e
+
+    def one(staged_item):
+        item, prepared = staged_item
+        path = item.path
+        try:
+            if isinstance(prepared, Exception): raise prepared
+            prepared, (meta, cover) = prepared
+            if not path.is_file(): raise FileNotFoundError(f"File not found: {path}")
+            return upload_book(client, path, meta, cover,
+                               verbose=args.verbose, limits=limits, prepared=prepared,
+                               ledger=ledger, force=args.force, metadata_only=args.metadata_only, retry=retry,
+                               journal=journal, chunks=chunks)
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+    # Hashing stage runs ahead of the uploads (and, with --single-pass, spools each
+    # book for them) so disk reads overlap with network transfers
+    # Size-scheduled runs report books as they finish; input order would hold every
+    # line back behind the small books that start last
+    def lane(items, jobs, hash_workers):
+        return run_ordered(one, staged(prepare, items, hash_workers, args.hash_queue or 2 * jobs), jobs,
+                           ordered=args.schedule == "input")
+
+    items = (BatchItem(p, e) for p, e in iter_batch_books(args))
+    if args.schedule == "size":
+        # Biggest books start first; with several jobs, large ones get a lane of their
+        # own so small books keep flowing next to the long transfers
+        large, small = size_lanes(items, args.large_mb * 1024 * 1024)
+        if large and small and args.jobs > 1:
+            lj = min(args.large_jobs or max(1, args.jobs // 4), args.jobs - 1)
+            lh = max(1, args.hash_workers * lj // args.jobs)
+            results = merged([lane(large, lj, lh), lane(small, args.jobs - lj, max(1, args.hash_workers - lh))],
+                             2 * args.jobs)
+        else:
+            results = lane(large + small, args.jobs, args.hash_workers)
+    else:
+        results = lane(items, args.jobs, args.hash_workers)
+    try:
+        for (item, _), res in results:
+            total += 1
+            ok += bool(res["ok"])
+            bytes_read += res.get("bytes_read", 0)
+            if res["ok"]: actions[res["action"]] = actions.get(res["action"], 0) + 1
+            metrics.book(item.path, res)
+            print(json.dumps({"file": str(item.path), **res}), flush=True)
+    finally:
+        if procs: procs.shutdown(cancel_futures=True)
+    summary = {"total": total, "ok": ok, "failed": total - ok, **actions, "bytes_read": bytes_read,
+               "elapsed_s": round(time.monotonic() - t0, 3), "phases": metrics.phase_summary(),
+               "connections": client.stats()}
+    if limits.adaptive: summary["limits"] = limits.current()
+    metrics.finish(summary)
+    print(json.dumps({"summary": summary}), flush=True)
+    return 0 if ok == total else 1
+
+async def run_batch_async(args, auth, cache=None, ledger=None, chunks=DEFAULT_CHUNKS, metrics=None, rates=NO_RATES):
+    """run_batch() on one event loop with AsyncBFClient; same output format."""
+    cover_path = await asyncio.to_thread(load_cover, args.cover)
+    total = ok = bytes_read = 0
+    actions = {}
+    t0 = time.monotonic()
+    metrics = metrics or Metrics()
+    limits = make_limits(args, metrics) if args.adaptive else None
+    hasher, procs = make_hasher(args)
+    async with AsyncBFClient(args.api_base, auth, limit=args.pool_size or max(10, args.jobs), rates=rates,
+                             timeout=(args.connect_timeout, args.read_timeout)) as client:
+        items = (BatchItem(p, e) for p, e in iter_batch_books(args))
+        if args.schedule == "size":
+            items = [b for lane in size_lanes(items, 0) for b in lane]
+        uploads = client.iter_uploads(items, lambda b: book_meta(args, b.path, cover_path, b.entry),
+                                      cover_path, jobs=args.jobs, verbose=args.verbose, retry=make_retry(args),
+                                      cache=cache, rehash=args.rehash, ledger=ledger, force=args.force, chunks=chunks,
+                                      limits=limits, ordered=args.schedule == "input", hasher=hasher)
+        try:
+            async for item, res in uploads:
+                total += 1
+                ok += bool(res["ok"])
+                bytes_read += res.get("bytes_read", 0)
+                if res["ok"]: actions[res["action"]] = actions.get(res["action"], 0) + 1
+                await asyncio.to_thread(metrics.book, item.path, res)
+                print(json.dumps({"file": str(item.path), **res}), flush=True)
+        finally:
+            if procs: procs.shutdown(cancel_futures=True)
+    summary = {"total": total, "ok": ok, "failed": total - ok, **actions, "bytes_read": bytes_read,
+               "elapsed_s": round(time.monotonic() - t0, 3), "phases": metrics.phase_summary()}
+    if limits: summary["limits"] = limits.current()
+    await asyncio.to_thread(metrics.finish, summary)
+    print(json.dumps({"summary": summary}), flush=True)
+    return 0 if ok == total else 1
+
+def main():
+    args = parse_args()
+    if args.prune_cache is not None:
+        removed, kept = DigestCache(StateDB(args.state_db)).prune(args.prune_cache or None)
+        print(json.dumps({"pruned": removed, "kept": kept}))
+        sys.exit(0)
+
+    rates, _ = make_rates(args)   # the RateControl thread (if any) lives as long as the process
+    if is_batch(args):
+        if args.title or args.isbn:
+            print("--title/--isbn describe a single book and can't be used in batch mode.", file=sys.stderr)
+            sys.exit(2)
+        if args.manifest:
+            # Structured manifests are checked in full before anything is sent; stdin is spooled for the second pass
+            args.manifest_format = manifest_format(args.manifest, args.manifest_format)
+            if args.manifest_format == "paths":
+                # Path lists are read lazily during the run, but one that can't be opened fails here
+                if args.manifest != "-":
+                    try:
+                        with open(args.manifest, encoding="utf-8"): pass
+                    except OSError as e:
+                        print(f"Can't read manifest: {e}", file=sys.stderr)
+                        sys.exit(2)
+            else:
+                if args.manifest == "-":
+                    args.manifest = tempfile.TemporaryFile("w+", encoding="utf-8", newline="")
+                    shutil.copyfileobj(sys.stdin, args.manifest)
+                try:
+                    records, invalid, errors = check_manifest(args.manifest, args.manifest_format)
+                except (OSError, csv.Error) as e:
+                    print(f"Can't read manifest: {e}", file=sys.stderr)
+                    sys.exit(2)
+                if invalid:
+                    for e in errors: print(e, file=sys.stderr)
+                    more = f" ({invalid - len(errors)} more not shown)" if invalid > len(errors) else ""
+                    print(f"{invalid} of {records} manifest records are invalid{more}; nothing was uploaded.", file=sys.stderr)
+                    sys.exit(2)
+        api_key = load_api_key(args)
+        cache, ledger, state = open_state(args, api_key)
+        chunks = ChunkSizes(args.chunk_size, state)
+        if args.use_async:
+            try:
+                rc = asyncio.run(run_batch_async(args, (api_key, ""), cache, ledger, chunks, make_metrics(args), rates))
+            finally:
+                if state: state.close()
+            sys.exit(rc)
+        journal = Journal(args.journal, account_key(args.api_base, api_key)) if args.journal else None
+        with contextlib.closing(make_client(args, (api_key, ""), rates)) as client:
+            try:
+                rc = run_batch(args, client, cache, ledger, journal, chunks, make_metrics(args))
+            finally:
+                if state: state.close()
+                if journal: journal.close()
+        sys.exit(rc)
+
+    path = Path(args.paths[0]).expanduser().resolve()
+    if not path.is_file():
+        print(f"File not found: {path}", file=sys.stderr)
+        sys.exit(1)
+
+    api_key = load_api_key(args)
+    auth = (api_key, "")   # Basic api_key:
+
+    cache, ledger, state = open_state(args, api_key)
+    chunks = ChunkSizes(args.chunk_size, state)
+    with contextlib.closing(make_client(args, auth, rates)) as client:
+        try:
+            prepared = prepare_book(path, cache, args.rehash, args.single_pass, args.spool_max * 1024 * 1024,
+                                    hasher=functools.partial(sha256_file, method=args.hash_method), chunks=chunks)
+            meta, cover = book_meta(args, path, args.cover or None)
+            res = upload_book(client, path, meta, cover, verbose=args.verbose,
+                              prepared=prepared, ledger=ledger, force=args.force, metadata_only=args.metadata_only,
+                              retry=make_retry(args), chunks=chunks)
+            metrics = make_metrics(args)
+            metrics.book(path, res)
+            metrics.finish({"total": 1, "ok": int(res["ok"]), "phases": metrics.phase_summary(),
+                            "connections": client.stats()})
+        finally:
+            if state: state.close()
+    if res["ok"]:
+        print(json.dumps({"ok": True, "bookfusion_id": res["bookfusion_id"], "key": res["key"]}, indent=2))
         sys.exit(0)
     else:
         print("Upload failed.", file=sys.stderr)
-        print(f"HTTP {r.status_code}", file=sys.stderr)
-        if js is not None:
-            print(json.dumps(js, indent=2), file=sys.stderr)
-        else:
-            print(r.text[:1000], file=sys.stderr)
+        if "status" in res: print(f"HTTP {res['status']}", file=sys.stderr)
+        err = res["error"]
+        print(err if isinstance(err, str) else json.dumps(err, indent=2), file=sys.stderr)
         sys.exit(1)
 
 if __name__ == "__main__":
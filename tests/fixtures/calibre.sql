@@ -0,0 +1,57 @@
+BEGIN TRANSACTION;
+CREATE TABLE authors ( id INTEGER PRIMARY KEY, name TEXT NOT NULL COLLATE NOCASE, sort TEXT COLLATE NOCASE, link TEXT NOT NULL DEFAULT "", UNIQUE(name));
+INSERT INTO "authors" VALUES(1,'Frank Herbert',NULL,'');
+INSERT INTO "authors" VALUES(2,'Herbert| Brian',NULL,'');
+INSERT INTO "authors" VALUES(3,'Anonymous',NULL,'');
+CREATE TABLE books ( id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL DEFAULT 'Unknown' COLLATE NOCASE,
+ sort TEXT COLLATE NOCASE, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, pubdate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+ series_index REAL NOT NULL DEFAULT 1.0, author_sort TEXT COLLATE NOCASE, isbn TEXT DEFAULT "" COLLATE NOCASE,
+ lccn TEXT DEFAULT "" COLLATE NOCASE, path TEXT NOT NULL DEFAULT "", flags INTEGER NOT NULL DEFAULT 1,
+ uuid TEXT, has_cover BOOL DEFAULT 0, last_modified TIMESTAMP NOT NULL DEFAULT "2000-01-01 00:00:00+00:00");
+INSERT INTO "books" VALUES(1,'Dune',NULL,'2026-10-16 09:48:54','1965-08-01 12:00:00+00:00',1.0,NULL,'','','Frank Herbert/Dune (1)',1,NULL,1,'2000-01-01 00:00:00+00:00');
+INSERT INTO "books" VALUES(2,'Notes',NULL,'2026-10-16 09:48:54','2001-01-01 12:00:00+00:00',1.0,NULL,'','','Anonymous/Notes (2)',1,NULL,0,'2000-01-01 00:00:00+00:00');
+INSERT INTO "books" VALUES(3,'Dune Messiah',NULL,'2026-10-16 09:48:54','0101-01-01 00:00:00+00:00',2.0,NULL,'','','Frank Herbert/Dune Messiah (3)',1,NULL,0,'2000-01-01 00:00:00+00:00');
+CREATE TABLE books_authors_link ( id INTEGER PRIMARY KEY, book INTEGER NOT NULL, author INTEGER NOT NULL, UNIQUE(book, author));
+INSERT INTO "books_authors_link" VALUES(1,1,2);
+INSERT INTO "books_authors_link" VALUES(2,1,1);
+INSERT INTO "books_authors_link" VALUES(3,2,3);
+INSERT INTO "books_authors_link" VALUES(4,3,1);
+CREATE TABLE books_languages_link ( id INTEGER PRIMARY KEY, book INTEGER NOT NULL, lang_code INTEGER NOT NULL, item_order INTEGER NOT NULL DEFAULT 0, UNIQUE(book, lang_code));
+INSERT INTO "books_languages_link" VALUES(1,1,2,1);
+INSERT INTO "books_languages_link" VALUES(2,1,1,0);
+CREATE TABLE books_series_link ( id INTEGER PRIMARY KEY, book INTEGER NOT NULL, series INTEGER NOT NULL, UNIQUE(book));
+INSERT INTO "books_series_link" VALUES(1,1,1);
+INSERT INTO "books_series_link" VALUES(2,3,1);
+CREATE TABLE books_tags_link ( id INTEGER PRIMARY KEY, book INTEGER NOT NULL, tag INTEGER NOT NULL, UNIQUE(book, tag));
+INSERT INTO "books_tags_link" VALUES(1,1,2);
+INSERT INTO "books_tags_link" VALUES(2,1,1);
+CREATE TABLE comments ( id INTEGER PRIMARY KEY, book INTEGER NOT NULL, text TEXT NOT NULL COLLATE NOCASE, UNIQUE(book));
+INSERT INTO "comments" VALUES(1,1,'<p>A desert planet.</p>');
+CREATE TABLE data ( id INTEGER PRIMARY KEY, book INTEGER NOT NULL, format TEXT NOT NULL COLLATE NOCASE, uncompressed_size INTEGER NOT NULL, name TEXT NOT NULL, UNIQUE(book, format));
+INSERT INTO "data" VALUES(1,1,'PDF',100,'Dune - Frank Herbert');
+INSERT INTO "data" VALUES(2,1,'EPUB',100,'Dune - Frank Herbert');
+INSERT INTO "data" VALUES(3,2,'TXT',100,'Notes - Anonymous');
+INSERT INTO "data" VALUES(4,3,'MOBI',100,'Dune Messiah - Frank Herbert');
+CREATE TABLE identifiers ( id INTEGER PRIMARY KEY, book INTEGER NOT NULL, type TEXT NOT NULL DEFAULT "isbn" COLLATE NOCASE, val TEXT NOT NULL COLLATE NOCASE, UNIQUE(book, type));
+INSERT INTO "identifiers" VALUES(1,1,'amazon','B00DUNE');
+INSERT INTO "identifiers" VALUES(2,1,'isbn','9780441172719');
+CREATE TABLE languages ( id INTEGER PRIMARY KEY, lang_code TEXT NOT NULL COLLATE NOCASE, UNIQUE(lang_code));
+INSERT INTO "languages" VALUES(1,'eng');
+INSERT INTO "languages" VALUES(2,'fra');
+CREATE TABLE series ( id INTEGER PRIMARY KEY, name TEXT NOT NULL COLLATE NOCASE, sort TEXT COLLATE NOCASE, UNIQUE (name));
+INSERT INTO "series" VALUES(1,'Dune Chronicles',NULL);
+CREATE TABLE tags ( id INTEGER PRIMARY KEY, name TEXT NOT NULL COLLATE NOCASE, UNIQUE (name));
+INSERT INTO "tags" VALUES(1,'sf');
+INSERT INTO "tags" VALUES(2,'classic');
+CREATE INDEX books_authors_link_aidx ON books_authors_link (author);
+CREATE INDEX books_authors_link_bidx ON books_authors_link (book);
+CREATE INDEX books_tags_link_aidx ON books_tags_link (tag);
+CREATE INDEX books_tags_link_bidx ON books_tags_link (book);
+CREATE INDEX books_series_link_aidx ON books_series_link (series);
+CREATE INDEX books_series_link_bidx ON books_series_link (book);
+CREATE INDEX books_languages_link_aidx ON books_languages_link (lang_code);
+CREATE INDEX books_languages_link_bidx ON books_languages_link (book);
+CREATE INDEX comments_idx ON comments (book);
+CREATE INDEX data_idx ON data (book);
+CREATE INDEX formats_idx ON data (format);
+COMMIT;
@@ -0,0 +1,48 @@
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bf_uploader import iter_calibre_library
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+@pytest.fixture
+def library(tmp_path):
+    # calibre.sql: Calibre's tables with three books; 2 only has a TXT file
+    con = sqlite3.connect(tmp_path / "metadata.db")
+    con.executescript((FIXTURES / "calibre.sql").read_text(encoding="utf-8"))
+    con.close()
+    return tmp_path
+
+def test_books_in_id_order(library):
+    books = list(iter_calibre_library(library))
+    dune, messiah = library / "Frank Herbert/Dune (1)", library / "Frank Herbert/Dune Messiah (3)"
+    assert books == [
+        (dune / "Dune - Frank Herbert.epub",
+         {"title": "Dune", "summary": "<p>A desert planet.</p>", "language": "eng", "isbn": "9780441172719",
+          "issued_on": "1965-08-01",
+          "author_list": ["Herbert, Brian", "Frank Herbert"],     # link order, '|' back to ','
+          "tag_list": ["classic", "sf"],
+          "series": [{"title": "Dune Chronicles", "index": 1.0}]},
+         str(dune / "cover.jpg")),
+        # 0101-01-01 is Calibre's unset date
+        (messiah / "Dune Messiah - Frank Herbert.mobi",
+         {"title": "Dune Messiah", "author_list": ["Frank Herbert"], "series": [{"title": "Dune Chronicles", "index": 2.0}]},
+         None),
+    ]
+
+def test_format_preference(library):
+    (path, _, _), = iter_calibre_library(library / "metadata.db", formats=("PDF",))
+    assert path.name == "Dune - Frank Herbert.pdf"
+
+def test_skipped_books_are_reported(library, capsys):
+    assert [m["title"] for _, m, _ in iter_calibre_library(library, formats=("EPUB", "PDF"), verbose=True)] == ["Dune"]
+    err = capsys.readouterr().err
+    assert "calibre book 2 (Notes)" in err and "calibre book 3 (Dune Messiah)" in err
+
+def test_missing_library(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        next(iter_calibre_library(tmp_path))
@@ -0,0 +1,40 @@
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bf_uploader import Cover, extract_metadata, read_epub_meta
+
+FIXTURES = Path(__file__).parent / "fixtures"
+JPEG = b"\xff\xd8\xff\xe0" + b"J" * 40 + b"\xff\xd9"
+
+def test_epub3_refines_collection_and_cover_image():
+    meta, cover = read_epub_meta(FIXTURES / "epub3.epub")
+    assert meta == {"title": "Dune", "summary": "A desert planet.", "language": "eng", "issued_on": "1965-08-01",
+                    "tag_list": ["sf", "classic"], "author_list": ["Frank Herbert"],   # the refined "edt" is dropped
+                    "isbn": "9780441172719", "series": [{"title": "Dune Chronicles", "index": 1.0}]}
+    # href is URL-quoted and relative to the OPF
+    assert cover == Cover("cover art.jpg", JPEG, "image/jpeg")
+
+def test_epub2_calibre_series_and_meta_cover():
+    meta, cover = read_epub_meta(FIXTURES / "epub2.epub")
+    # a modification date isn't the publication date
+    assert meta == {"title": "Dune Messiah", "language": "fre", "author_list": ["Frank Herbert"],
+                    "isbn": "0441172717", "series": [{"title": "Dune Chronicles", "index": 2.0}]}
+    assert cover == Cover("cover.jpg", JPEG, "image/jpeg")
+
+def test_cover_false_reads_no_image():
+    meta, cover = read_epub_meta(FIXTURES / "epub3.epub", cover=False)
+    assert meta["title"] == "Dune" and cover is None
+
+def test_not_a_zip(tmp_path):
+    p = tmp_path / "broken.epub"
+    p.write_bytes(b"not a zip")
+    with pytest.raises(zipfile.BadZipFile):
+        read_epub_meta(p)
+
+def test_extract_metadata_by_suffix(tmp_path):
+    assert extract_metadata(FIXTURES / "epub2.epub", cover=False)[0]["title"] == "Dune Messiah"
+    assert extract_metadata(tmp_path / "notes.txt") == ({}, None)
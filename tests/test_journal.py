@@ -0,0 +1,108 @@
+import base64
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bf_uploader import NO_RATES, Journal, prepare_book, upload_book
+
+ACCOUNT = ("https://www.bookfusion.com/calibre-api/v1", "0123456789abcdef")
+
+class FakeClient:
+    """Records the calls an upload makes; every call succeeds."""
+    rates = NO_RATES
+
+    def __init__(self):
+        self.calls = []
+
+    def init(self, filename, digest, verbose=False):
+        self.calls.append("init")
+        return {"url": "https://s3.example/bucket", "params": {"key": f"uploads/{digest[:8]}"}}
+
+    def s3_post(self, url, params, path, verbose=False, source=None, chunk=None):
+        self.calls.append("s3")
+
+    def finalize(self, key, digest, meta, meta_digest, cover, verbose=False):
+        self.calls.append("finalize")
+        return SimpleNamespace(status_code=201, json=lambda: {"id": "bf-1"}, text="")
+
+@pytest.fixture
+def book(tmp_path):
+    p = tmp_path / "book.epub"
+    p.write_bytes(b"book bytes")
+    return p
+
+def reopen(journal):
+    journal.close()
+    return Journal(journal.path, ACCOUNT)
+
+def upload(journal, path, client=None):
+    client = client or FakeClient()
+    res = upload_book(client, path, {"title": "Book"}, journal=journal, prepared=prepare_book(path, journal=journal))
+    return client.calls, res
+
+def test_last_record_per_path_wins(tmp_path, book):
+    j = Journal(tmp_path / "j.jsonl", ACCOUNT)
+    st = book.stat()
+    j.log(book, st, "hashed", digest="d")
+    j.log(book, st, "uploaded", digest="d", key="k")
+    rec = reopen(j).get(book, st)
+    assert (rec["phase"], rec["key"]) == ("uploaded", "k")
+
+def test_changed_file_is_not_resumed(tmp_path, book):
+    j = Journal(tmp_path / "j.jsonl", ACCOUNT)
+    j.log(book, book.stat(), "hashed", digest="d")
+    book.write_bytes(b"edited since")
+    assert reopen(j).get(book, book.stat()) is None
+
+def test_other_account_is_not_resumed(tmp_path, book):
+    j = Journal(tmp_path / "j.jsonl", ACCOUNT)
+    j.log(book, book.stat(), "hashed", digest="d")
+    j.close()
+    assert Journal(j.path, (ACCOUNT[0], "fedcba9876543210")).get(book, book.stat()) is None
+
+def test_torn_last_line_is_ignored(tmp_path, book):
+    j = Journal(tmp_path / "j.jsonl", ACCOUNT)
+    j.log(book, book.stat(), "hashed", digest="d")
+    j.close()
+    with open(j.path, "a") as f: f.write('{"path": "' + str(book))     # crash mid-append
+    assert Journal(j.path, ACCOUNT).get(book, book.stat())["digest"] == "d"
+
+def test_overgrown_journal_is_compacted(tmp_path, book):
+    j = Journal(tmp_path / "j.jsonl", ACCOUNT)
+    for i in range(1100): j.log(book, book.stat(), "hashed", digest=str(i))
+    j = reopen(j)
+    assert j.path.read_text().count("\n") == 1
+    assert j.get(book, book.stat())["digest"] == "1099"
+
+def test_resume_from_each_phase(tmp_path, book):
+    # a full run journals every phase; each phase it reached is skipped on the rerun
+    j = Journal(tmp_path / "j.jsonl", ACCOUNT)
+    calls, res = upload(j, book)
+    assert calls == ["init", "s3", "finalize"] and res["ok"]
+    j.close()
+    lines = [json.loads(line) for line in j.path.read_text().splitlines()]
+    assert [r["phase"] for r in lines] == ["hashed", "inited", "uploaded", "finalized"]
+
+    for upto, expect in [("finalized", []), ("uploaded", ["finalize"]), ("inited", ["s3", "finalize"]),
+                         ("hashed", ["init", "s3", "finalize"])]:
+        cut = [json.dumps(r) for r in lines[:[r["phase"] for r in lines].index(upto) + 1]]
+        j.path.write_text("\n".join(cut) + "\n")
+        j = Journal(j.path, ACCOUNT)
+        calls, res = upload(j, book)
+        assert calls == expect and res["ok"], upto
+        # the digest comes from the journal; only the S3 POST reads the book
+        assert res["bytes_read"] == (book.stat().st_size if "s3" in expect else 0)
+        assert res["action"] == ("skipped" if upto == "finalized" else "uploaded")
+        j.close()
+
+def test_expired_presign_is_not_reused(tmp_path, book):
+    j = Journal(tmp_path / "j.jsonl", ACCOUNT)
+    digest = prepare_book(book, journal=j).digest
+    policy = base64.b64encode(json.dumps({"expiration": "2020-01-01T00:00:00Z"}).encode()).decode()
+    j.log(book, book.stat(), "inited", digest=digest, init={"url": "u", "params": {"key": "old", "policy": policy}})
+    calls, res = upload(reopen(j), book)
+    assert calls[:2] == ["init", "s3"] and res["key"] != "old"
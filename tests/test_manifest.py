@@ -0,0 +1,67 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bf_uploader
+from bf_uploader import check_manifest, iter_manifest_records, manifest_format
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+def test_jsonl_records():
+    # comments and blank lines skipped; paths resolve against the manifest's directory
+    assert check_manifest(FIXTURES / "manifest.jsonl", "jsonl") == (2, 0, [])
+    assert list(iter_manifest_records(FIXTURES / "manifest.jsonl", "jsonl")) == [
+        (FIXTURES / "epub3.epub", {"title": "Dune", "authors": ["Frank Herbert"], "tags": ["sf", "classic"],
+                                   "series": [{"title": "Dune Chronicles", "index": 1}]}),
+        (FIXTURES / "book.mobi", {"isbn": "978-0-441-47812-5", "issued_on": "1969-03-01", "shelves": ["Favourites"],
+                                  "cover": str(FIXTURES / "epub3.epub")}),
+    ]
+
+def test_csv_records():
+    # singular/hyphenated headers map to the CLI dests; empty cells are left out
+    assert check_manifest(FIXTURES / "manifest.csv", "csv") == (2, 0, [])
+    assert list(iter_manifest_records(FIXTURES / "manifest.csv", "csv")) == [
+        (FIXTURES / "epub2.epub", {"title": "Dune Messiah", "authors": ["Frank Herbert"], "tags": ["sf", "classic"],
+                                   "series": ["Dune Chronicles:2"]}),
+        (FIXTURES / "info.pdf", {"title": "Title, with comma", "authors": ["A. Author", "B. Writer"], "issued_on": "2001-01-01"}),
+    ]
+
+def test_every_bad_record_is_reported():
+    records, invalid, errors = check_manifest(FIXTURES / "bad.jsonl", "jsonl")
+    assert (records, invalid) == (12, 11)
+    assert errors == [
+        f"manifest line 2: path not found: {FIXTURES / 'missing.epub'}",
+        "manifest line 3: invalid JSON (Expecting value)",
+        "manifest line 4: expected a JSON object",
+        "manifest line 5: no path",
+        "manifest line 6: unknown field 'colour'",
+        "manifest line 7: not an ISBN: '123'",
+        "manifest line 8: issued_on must be YYYY-MM-DD, got '1965'",
+        "manifest line 9: series index must be a number in 'Dune:first' (use {\"title\", \"index\"} for titles with ':')",
+        "manifest line 10: series index must be a number, got '1'",
+        "manifest line 11: tags must be a string or a list of strings",
+        "manifest line 12: title must be a string",
+    ]
+
+def test_csv_row_longer_than_header():
+    assert check_manifest(FIXTURES / "bad.csv", "csv") == (1, 1, ["manifest line 2: more columns than the header"])
+
+def test_errors_shown_are_capped(monkeypatch):
+    monkeypatch.setattr(bf_uploader, "MANIFEST_ERRORS_SHOWN", 3)
+    records, invalid, errors = check_manifest(FIXTURES / "bad.jsonl", "jsonl")
+    assert (records, invalid, len(errors)) == (12, 11, 3)
+
+def test_streaming_parse_skips_file_checks():
+    # the upload reports a missing file per book; the streaming pass stops only on malformed records
+    records = iter_manifest_records(FIXTURES / "bad.jsonl", "jsonl")
+    assert [p.name for p, _ in [next(records), next(records)]] == ["epub3.epub", "missing.epub"]
+    with pytest.raises(ValueError, match="^manifest line 3: invalid JSON"):
+        next(records)
+
+@pytest.mark.parametrize("manifest, fmt", [("books.jsonl", "jsonl"), ("books.NDJSON", "jsonl"), ("books.json", "jsonl"),
+                                           ("books.csv", "csv"), ("books.txt", "paths"), ("-", "paths")])
+def test_format_by_extension(manifest, fmt):
+    assert manifest_format(manifest) == fmt
+    assert manifest_format(manifest, "csv") == "csv"
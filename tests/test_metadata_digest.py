@@ -0,0 +1,84 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bf_uploader import BookEntry, Cover, book_meta, build_meta, compute_calibre_metadata_digest, manifest_fields, norm_index, parse_args
+
+META = {
+    "title": "Dune",
+    "summary": "A desert planet.",
+    "language": "eng",
+    "isbn": "9780441172719",
+    "issued_on": "1965-08-01",
+    "series": [{"title": "Dune", "index": 1}],
+    "author_list": ["Frank Herbert"],
+    "tag_list": ["sf", "classic"],
+    "bookshelves": ["Favourites"],
+}
+
+NO_COVER = "9e63787246b5fff54fcfe21a27aa6825fc962ab8cab2b5f35c2422a2c3f7851d"
+
+# sha256(metadata fields + N zero bytes + b"\x00" + cover), cover byte i = i % 251;
+# sizes straddle the 64 KiB zero buffer the digest is fed from
+COVERS = {
+    0: "e299e3df0a38934960b8ff37ccb8ee608c4f2b0690ce1948c4017c7b810b3f7a",
+    1: "d86af514f92d91217d8362e723db1918add826c12563e2580bb0f1079107f078",
+    65535: "3b9d7622115451ef4050b4bc765dd0d7fb70115b474bc6242c9a0a2aaff2fe94",
+    65536: "0c8fa3c841a2494c83fb055be43ca24365fba737ffc240da2e771cff045445b9",
+    65537: "d6350beebabae83fe64de6626ef90176fe8663167753459304bb96de77747f40",
+    300000: "bc7958840883743a3d5d4b4491fd7c69e960843609250bdcb30676a5966ff393",
+}
+
+def cover_bytes(n):
+    return bytes(i % 251 for i in range(n))
+
+def test_no_cover():
+    assert compute_calibre_metadata_digest(META, None) == NO_COVER
+
+@pytest.mark.parametrize("size", sorted(COVERS))
+def test_cover_path(tmp_path, size):
+    p = tmp_path / "cover.jpg"
+    p.write_bytes(cover_bytes(size))
+    assert compute_calibre_metadata_digest(META, str(p)) == COVERS[size]
+
+@pytest.mark.parametrize("size", sorted(COVERS))
+def test_cover_object(size):
+    cover = Cover("cover.jpg", cover_bytes(size), "image/jpeg")
+    assert compute_calibre_metadata_digest(META, cover) == COVERS[size]
+
+def test_missing_cover_path(tmp_path):
+    assert compute_calibre_metadata_digest(META, str(tmp_path / "nope.jpg")) == NO_COVER
+
+def test_cover_path_is_directory(tmp_path):
+    assert compute_calibre_metadata_digest(META, str(tmp_path)) == NO_COVER
+
+@pytest.mark.parametrize("raw", ["1", "1.0", " 1 ", 1, 1.0])
+def test_series_index_as_calibre_stores_it(raw):
+    # OPF/XMP text and the float from metadata.db must hash alike ("1.0")
+    meta = {**META, "series": [{"title": "Dune", "index": norm_index(raw)}]}
+    assert compute_calibre_metadata_digest(meta, None) == compute_calibre_metadata_digest(
+        {**META, "series": [{"title": "Dune", "index": 1.0}]}, None)
+
+def cli_args(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["bf_uploader.py", "book.epub", "--api-key", "k", "--no-embedded-meta", *argv])
+    return parse_args()
+
+def test_cli_and_manifest_series_index_match_embedded(monkeypatch, tmp_path):
+    book = tmp_path / "dune.epub"
+    book.write_bytes(b"")
+    # What the EPUB/PDF/MOBI readers and the Calibre library hand over for series index 1
+    embedded = build_meta(cli_args(monkeypatch), book, {"title": "Dune", "series": [{"title": "Dune", "index": norm_index("1")}]})
+    want = compute_calibre_metadata_digest(embedded, None)
+
+    from_cli = build_meta(cli_args(monkeypatch, "--title", "Dune", "--series", "Dune:1"), book)
+    assert compute_calibre_metadata_digest(from_cli, None) == want
+
+    args = cli_args(monkeypatch)
+    for record in ({"path": book.name, "title": "Dune", "series": "Dune:1"},
+                   {"path": book.name, "title": "Dune", "series": {"title": "Dune", "index": 1}}):
+        _, fields = manifest_fields(json.dumps(record), tmp_path)
+        meta, _ = book_meta(args, book, entry=BookEntry(fields=fields))
+        assert compute_calibre_metadata_digest(meta, None) == want
@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bf_uploader import Cover, read_mobi_meta
+
+FIXTURES = Path(__file__).parent / "fixtures"
+JPEG = b"\xff\xd8\xff\xe0" + b"J" * 40 + b"\xff\xd9"
+
+def test_exth_records_and_cover():
+    meta, cover = read_mobi_meta(FIXTURES / "book.mobi")
+    # EXTH 503 beats the full name; authors split on ';', the language tag beats the locale
+    assert meta == {"title": "Lëft Hand", "summary": "Désc", "author_list": ["Ursula K. Le Guin", "Second Author"],
+                    "tag_list": ["SF", "Classics"], "isbn": "9780441478125", "issued_on": "1969-03-01", "language": "eng"}
+    # EXTH 201 counts from the first image record (a GIF here), so the cover is the next one
+    assert cover == Cover("cover.jpg", JPEG, "image/jpeg")
+
+def test_kf8_cp1252_header_fallbacks():
+    meta, cover = read_mobi_meta(FIXTURES / "book.azw3")
+    # no EXTH title or language: the header's full name and locale (0x0C, French) stand in
+    assert meta == {"title": "Título", "author_list": ["Müller", "Schmidt"], "language": "fra"}
+    assert cover is None   # no EXTH 201/202
+
+def test_cover_false():
+    assert read_mobi_meta(FIXTURES / "book.mobi", cover=False)[1] is None
+
+@pytest.mark.parametrize("data", [b"x" * 50, (FIXTURES / "book.mobi").read_bytes()[:100]])
+def test_not_a_mobi(tmp_path, data):
+    p = tmp_path / "junk.mobi"
+    p.write_bytes(data)
+    with pytest.raises(ValueError):
+        read_mobi_meta(p)
@@ -0,0 +1,63 @@
+import asyncio
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bf_uploader import MultipartFileBody, TokenBucket, encode_multipart
+
+FIELDS = {"key": "uploads/abc/${filename}", "policy": "eyJleHBpcmF0aW9uIjoi", "x-amz-signature": "0f" * 32,
+          "success_action_status": 201}
+DATA = bytes(range(256)) * 40 + b"tail"
+
+@pytest.fixture
+def same_boundary(monkeypatch):
+    # requests (through urllib3's choose_boundary) and the encoders here all draw the boundary from os.urandom(16)
+    monkeypatch.setattr(os, "urandom", lambda n: b"\x42" * n)
+
+def requests_body(files, data=None):
+    req = requests.Request("POST", "https://s3.example/bucket", data=data, files=files).prepare()
+    return req.body, req.headers["Content-Type"]
+
+@pytest.fixture
+def book(tmp_path):
+    p = tmp_path / 'Dune "Deluxe".epub'
+    p.write_bytes(DATA)
+    return p
+
+@pytest.mark.parametrize("chunk", [1000, len(DATA), 1 << 20])
+def test_file_body_matches_requests(same_boundary, book, chunk):
+    body = MultipartFileBody(FIELDS, "file", book, chunk=chunk)
+    with open(book, "rb") as f:
+        want, ctype = requests_body({"file": (book.name, f, "application/epub+zip")},
+                                    {k: str(v) for k, v in FIELDS.items()})
+    assert b"".join(body) == want
+    assert body.content_type == ctype
+    assert len(body) == len(want)
+    assert b"".join(body) == want            # iterating again re-reads the file
+
+def test_source_and_async_chunks(same_boundary, book):
+    want = b"".join(MultipartFileBody(FIELDS, "file", book))
+    spooled = MultipartFileBody(FIELDS, "file", book, source=io.BytesIO(DATA))
+    assert b"".join(spooled) == want and len(spooled) == len(want)
+
+    async def collect(body):
+        return [c async for c in body.aiter_chunks()]
+    chunks = asyncio.run(collect(MultipartFileBody(FIELDS, "file", book, chunk=4096)))
+    assert b"".join(chunks) == want and max(map(len, chunks[1:-1])) == 4096
+
+def test_limiter_takes_every_file_byte(book):
+    taken = []
+    class Limiter(TokenBucket):
+        def take(self, n=1): taken.append(n)
+    b"".join(MultipartFileBody(FIELDS, "file", book, chunk=4096, limiter=Limiter()))
+    assert sum(taken) == len(DATA) and max(taken) == 4096
+
+def test_encode_multipart_matches_requests(same_boundary):
+    parts = [("metadata[title]", (None, "Gödel, Escher, Bach")), ("metadata[author_list][]", (None, "D. H.")),
+             ("cover", ("cover.jpg", b"\xff\xd8jpeg", "image/jpeg"))]
+    assert encode_multipart(parts) == requests_body(parts)
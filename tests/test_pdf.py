@@ -0,0 +1,51 @@
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from bf_uploader import Cover, read_pdf_meta
+
+FIXTURES = Path(__file__).parent / "fixtures"
+JPEG = b"\xff\xd8\xff\xe0" + b"J" * 40 + b"\xff\xd9"
+
+XMP_META = {"title": "Gödel, Escher, Bach", "summary": "A book about things", "author_list": ["Douglas Hofstadter"],
+            "tag_list": ["Math", "AI"], "issued_on": "1979-01-01", "isbn": "9780465026562", "language": "eng",
+            "series": [{"title": "Eternal Golden Braid", "index": 2.5}]}
+
+@pytest.mark.parametrize("name", ["classic.pdf", "xrefstream.pdf"])
+def test_xmp_wins_over_info(name):
+    # xrefstream.pdf keeps the catalog and /Info in a compressed object stream behind a PNG-predicted xref stream
+    meta, cover = read_pdf_meta(FIXTURES / name, cover=False)
+    assert meta == XMP_META   # /Subject only comes from /Info
+    assert cover is None
+
+def test_info_dictionary():
+    meta, _ = read_pdf_meta(FIXTURES / "info.pdf", cover=False)
+    # UTF-16BE title, escaped parentheses and a backslash-newline in literal strings, /Lang from the catalog
+    assert meta == {"title": "Info Title é", "summary": "A book about things", "author_list": ["A. Author", "B. (Bee) Writer"],
+                    "tag_list": ["one", "two", "three"], "language": "deu"}
+
+def test_incremental_update_replaces_info():
+    meta, _ = read_pdf_meta(FIXTURES / "incremental.pdf", cover=False)
+    assert meta == {"title": "Updated Title", "author_list": ["New Author"], "language": "deu"}
+
+def test_first_page_cover_skips_small_images():
+    # page 1 holds a 600x800 JPEG and a 100x100 one below PDF_COVER_MIN_PX
+    _, cover = read_pdf_meta(FIXTURES / "classic.pdf")
+    assert cover == Cover("cover.jpg", JPEG, "image/jpeg")
+
+def test_encrypted(tmp_path):
+    data = (FIXTURES / "info.pdf").read_bytes()
+    prev = int(re.findall(rb"startxref\s+(\d+)", data)[-1])
+    p = tmp_path / "enc.pdf"
+    p.write_bytes(data + b"xref\n0 0\ntrailer\n<< /Size 8 /Root 1 0 R /Encrypt << /Filter /Standard >> /Prev %d >>\n"
+                         b"startxref\n%d\n%%%%EOF\n" % (prev, len(data)))
+    assert read_pdf_meta(p) == ({}, None)
+
+def test_not_a_pdf(tmp_path):
+    p = tmp_path / "junk.pdf"
+    p.write_bytes(b"%PDF-1.4\nnot really\n")
+    with pytest.raises(ValueError):
+        read_pdf_meta(p)
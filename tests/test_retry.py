@@ -0,0 +1,92 @@
+import asyncio
+import sys
+from email.utils import formatdate
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bf_uploader
+from bf_uploader import HTTPStatusError, RetryPolicy, parse_retry_after
+
+def http_error(status, retry_after=None):
+    headers = {"Retry-After": retry_after} if retry_after else {}
+    return HTTPStatusError(f"HTTP {status}", SimpleNamespace(status_code=status, headers=headers, text=""))
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    waited = []
+    monkeypatch.setattr(bf_uploader.time, "sleep", waited.append)
+    return waited
+
+def failing(*errors, result="ok"):
+    errors = list(errors)
+    def fn():
+        if errors: raise errors.pop(0)
+        return result
+    return fn
+
+def test_backoff_is_capped_full_jitter(monkeypatch):
+    monkeypatch.setattr(bf_uploader.random, "uniform", lambda lo, hi: hi)     # the top of each range
+    p = RetryPolicy(base_delay=0.5, max_delay=3.0)
+    assert [p.delay(a) for a in range(1, 6)] == [0.5, 1.0, 2.0, 3.0, 3.0]
+    monkeypatch.setattr(bf_uploader.random, "uniform", lambda lo, hi: lo)
+    assert p.delay(4) == 0.0
+    assert p.delay(4, retry_after=7.0) == 7.0        # Retry-After is a floor
+
+def test_retries_transient_failures(sleeps):
+    tries = {}
+    fn = failing(requests.ConnectionError(), requests.Timeout(), http_error(503))
+    assert RetryPolicy(attempts=4).call("init", fn, tries) == "ok"
+    assert tries == {"init": 3} and len(sleeps) == 3
+
+def test_gives_up_after_attempts(sleeps):
+    tries = {}
+    fn = failing(*[http_error(502)] * 3)
+    with pytest.raises(HTTPStatusError):
+        RetryPolicy(attempts=3).call("s3", fn, tries)
+    assert tries == {"s3": 2} and len(sleeps) == 2
+
+@pytest.mark.parametrize("error", [http_error(400), http_error(403), ValueError("bug")])
+def test_permanent_failures_are_not_retried(sleeps, error):
+    with pytest.raises(type(error)):
+        RetryPolicy().call("finalize", failing(error))
+    assert sleeps == []
+
+def test_custom_retryable(sleeps):
+    expired = http_error(403)
+    assert RetryPolicy().call("s3", failing(expired), retryable=lambda e: e is expired) == "ok"
+
+def test_retry_after_header(sleeps, monkeypatch):
+    monkeypatch.setattr(bf_uploader.random, "uniform", lambda lo, hi: lo)
+    RetryPolicy().call("init", failing(http_error(429, "12")))
+    assert sleeps == [12.0]
+
+@pytest.mark.parametrize("value, want", [("5", 5.0), ("-3", 0.0), ("", None), ("soon", None),
+                                         (formatdate(0, usegmt=True), 0.0)])
+def test_parse_retry_after(value, want):
+    assert parse_retry_after(value) == want
+
+def test_budget_is_shared_and_runs_out(sleeps):
+    p = RetryPolicy(attempts=5, budget=3)
+    assert p.call("init", failing(requests.Timeout(), requests.Timeout())) == "ok"
+    with pytest.raises(requests.Timeout):
+        p.call("s3", failing(requests.Timeout(), requests.Timeout()))       # one retry left, then it fails fast
+    assert p.budget == 0 and len(sleeps) == 3
+    with pytest.raises(requests.Timeout):
+        p.call("finalize", failing(requests.Timeout()))
+    assert len(sleeps) == 3
+
+def test_acall(monkeypatch):
+    waited = []
+    async def sleep(d): waited.append(d)
+    monkeypatch.setattr(bf_uploader.asyncio, "sleep", sleep)
+    errors = [http_error(500)]
+    async def fn():
+        if errors: raise errors.pop()
+        return "ok"
+    tries = {}
+    assert asyncio.run(RetryPolicy().acall("init", fn, tries)) == "ok"
+    assert tries == {"init": 1} and len(waited) == 1
@@ -0,0 +1,77 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import bf_uploader
+from bf_uploader import RateLimits, TokenBucket
+
+class Clock:
+    """Stands in for time.monotonic/time.sleep: sleeping moves the clock."""
+    def __init__(self):
+        self.now, self.sleeps = 0.0, []
+
+    def sleep(self, d):
+        self.sleeps.append(round(d, 6))
+        self.now += d
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(bf_uploader.time, "monotonic", lambda: c.now)
+    monkeypatch.setattr(bf_uploader.time, "sleep", c.sleep)
+    return c
+
+def test_unlimited(clock):
+    b = TokenBucket()
+    for _ in range(1000): b.take(10 ** 9)
+    assert clock.sleeps == []
+
+def test_steady_rate(clock):
+    b = TokenBucket(10)
+    for _ in range(5): b.take()
+    assert clock.sleeps == [0.1] * 5 and clock.now == pytest.approx(0.5)
+
+def test_idle_refill_is_capped_at_burst(clock):
+    b = TokenBucket(10, burst=5)
+    clock.now += 60
+    for _ in range(5): b.take()
+    assert clock.sleeps == []
+    b.take()
+    assert clock.sleeps == [0.1]
+
+def test_debt_queues_later_callers(clock):
+    b = TokenBucket(10)
+    assert b._reserve(30) == pytest.approx(3.0)         # a big S3 body ahead in line
+    assert b._reserve(1) == pytest.approx(3.1)          # the next caller waits behind it
+    clock.now += 3.1
+    assert b._reserve(1) == pytest.approx(0.1)
+
+def test_set_rate(clock):
+    b = TokenBucket(10)
+    clock.now += 60
+    b.set_rate(2)            # saved tokens shrink to the new burst
+    for _ in range(3): b.take()
+    assert clock.sleeps == [0.5]
+    b.set_rate(None)
+    b.take(100)
+    assert clock.sleeps == [0.5]
+
+def test_rate_limits_set(clock):
+    rates = RateLimits(s3_bytes=2e6, api_rps=20)
+    assert str(rates) == "S3 2 MB/s, API 20 req/s"
+    rates.set(api_rps=5)
+    assert str(rates) == "S3 unlimited, API 5 req/s"
+    rates.api.take()
+    assert clock.sleeps == [0.2]
+
+def test_atake(clock, monkeypatch):
+    async def sleep(d): clock.sleep(d)
+    monkeypatch.setattr(bf_uploader.asyncio, "sleep", sleep)
+    b = TokenBucket(4)
+    async def run():
+        for _ in range(2): await b.atake()
+    asyncio.run(run())
+    assert clock.sleeps == [0.25, 0.25]